@@ -31,33 +31,108 @@
 import sqlite3
 import pandas as pd
 import os
+import functools
+from claim_reservation import init_claim_schema, reserve_claim, get_connection as get_claim_connection, RESERVED, CONFLICT
+from geo_index import build_listing_index, receiver_coordinates, open_listing_filter
+from search_index import build_search_index, init_search_version, search_version
+from forecasting import init_forecasts
+from sharded_ingest import FEEDS_DIR, discover_shards, ingest_shards, sharded_distinct, map_reduce
+from validation import read_validated, write_quarantine
+from history import init_history, compact_history_if_due, attach_as_of, history_range, data_version, source_fingerprint, snapshot_loaded, record_snapshot
+from leaderboards import init_leaderboards, top_k, compute_top_k, scores, ALL_CITIES
+from chart_prep import prepare_bar_chart, log_bins, table_page, TABLE_PAGE_ROWS
+from sketches import init_sketches, sketch_config, approx_distinct, approx_distinct_by_city, heavy_hitters, sketch_file, merge_sketch_sets
 
 # Create the path for csv file to detect the environment
 
-# Detect environment (local vs Streamlit Cloud)
-if os.path.exists("receivers_claims.csv") and os.path.exists("providers_foodlisting.csv"):
+# Name the path
+DB_PATH = ('food_waste.db')
+
+# Listings already expired on this date are quarantined. The bundled CSVs are a
+# March 2025 snapshot, so the check is anchored there; live feeds can use today.
+EXPIRY_AS_OF = '2025-03-01'
+quarantined = None
+
+# Listing/claim history: every change is kept for HISTORY_FULL_DETAIL_DAYS, then
+# thinned to one version per day, and dropped after HISTORY_RETENTION_DAYS
+HISTORY_FULL_DETAIL_DAYS = 30
+HISTORY_RETENTION_DAYS = 365
+
+# Error bounds of the approximate counts: relative standard error of distinct
+# counts, and the count-min overcount (epsilon * total claims) and its failure probability
+SKETCH_DISTINCT_ERROR = 0.02
+SKETCH_COUNT_EPSILON = 0.001
+SKETCH_COUNT_DELTA = 0.01
+
+# Detect environment (sharded feeds, local vs Streamlit Cloud)
+sharded_feeds = os.path.isdir(FEEDS_DIR) and all(discover_shards(FEEDS_DIR).values())
+if sharded_feeds:
+    # Per-region shard files
+    source_paths = sum(discover_shards(FEEDS_DIR).values(), [])
+elif os.path.exists("receivers_claims.csv") and os.path.exists("providers_foodlisting.csv"):
     # Running on Streamlit Cloud (or if CSVs are in the same repo folder)
-    receivers_claims = pd.read_csv("receivers_claims.csv")
-    providers_foodlisting = pd.read_csv("providers_foodlisting.csv")
+    source_paths = ["providers_foodlisting.csv", "receivers_claims.csv"]
 else:
     # Running locally on Windows
-    receivers_claims = pd.read_csv(r"C:\Users\anous\Downloads\foodmanagement\receivers_claims.csv")
-    providers_foodlisting = pd.read_csv(r"C:\Users\anous\Downloads\foodmanagement\providers_foodlisting.csv")
+    source_paths = [r"C:\Users\anous\Downloads\foodmanagement\providers_foodlisting.csv",
+                    r"C:\Users\anous\Downloads\foodmanagement\receivers_claims.csv"]
+
+# Only reload the database when the source files changed, so edits made in the
+# dashboard survive reruns and the history only records real changes
+conn = sqlite3.connect(DB_PATH)
+source_snapshot = source_fingerprint(source_paths)
+reload_sources = not snapshot_loaded(conn, source_snapshot)
+conn.close()
+
+if reload_sources and sharded_feeds:
+    # Parsed in a process pool and written by a single writer
+    print(ingest_shards(FEEDS_DIR, DB_PATH, expiry_as_of=EXPIRY_AS_OF))
+elif reload_sources:
+    providers_foodlisting, receivers_claims, quarantined = read_validated(*source_paths, as_of=EXPIRY_AS_OF)
+if sharded_feeds or not reload_sources:
+    # The rows are already in the database; only the column lists are used below
+    conn = sqlite3.connect(DB_PATH)
+    receivers_claims = pd.read_sql_query("SELECT * FROM receivers_claims LIMIT 0", conn)
+    providers_foodlisting = pd.read_sql_query("SELECT * FROM providers_foodlisting LIMIT 0", conn)
+    conn.close()
 
 print("✅ Data loaded successfully")
+if quarantined is not None:
+    print("Rows quarantined:", len(quarantined))
 print("Receivers Claims columns:", receivers_claims.columns.tolist())
 print("Providers Foodlisting columns:", providers_foodlisting.columns.tolist())
 
 
-# Name the path
-DB_PATH = ('food_waste.db')
 # Create SQLite database (or connect if it exists)
 conn = sqlite3.connect(DB_PATH)
 
-# Write DataFrames to SQLite tables
+# Write DataFrames to SQLite tables (sharded feeds are already written)
 conn = sqlite3.connect(DB_PATH)
-receivers_claims.to_sql('receivers_claims', conn, if_exists='replace', index=False)
-providers_foodlisting.to_sql('providers_foodlisting', conn, if_exists='replace', index=False)
+if reload_sources and not sharded_feeds:
+    receivers_claims.to_sql('receivers_claims', conn, if_exists='replace', index=False)
+    providers_foodlisting.to_sql('providers_foodlisting', conn, if_exists='replace', index=False)
+    write_quarantine(conn, quarantined)
+if reload_sources:
+    record_snapshot(conn, source_snapshot)
+# Track the quantity still free to claim on each listing
+init_claim_schema(conn)
+# Keep valid-from/valid-to versions of every listing and claim, and bound their growth
+init_history(conn, reconcile=reload_sources)
+# (compaction runs after a reload and otherwise at most once a day, not on every rerun)
+now = pd.Timestamp.now(tz="UTC").tz_localize(None)
+compact_history_if_due(conn,
+                       retain_after=now - pd.Timedelta(days=HISTORY_RETENTION_DAYS),
+                       thin_before=now - pd.Timedelta(days=HISTORY_FULL_DETAIL_DAYS),
+                       force=reload_sources)
+# Top-N rollups for providers, receivers and food items, kept current by triggers
+init_leaderboards(conn, rebuild=reload_sources)
+# Distinct-count and heavy-hitter sketches, extended with the rows added since the last run
+init_sketches(conn, rebuild=reload_sources,
+              config=sketch_config(SKETCH_DISTINCT_ERROR, SKETCH_COUNT_EPSILON, SKETCH_COUNT_DELTA))
+# Version counter of the fuzzy search index, bumped when a searchable name or address changes
+init_search_version(conn)
+# Refit the demand forecasts when the claim history changed since the last fit
+init_forecasts(conn, data_version(conn), refit=reload_sources)
 conn.close()
 
 
@@ -91,6 +166,26 @@ GROUP BY City;
 result = pd.read_sql_query(query, conn)
 print(result)
 
+# With sharded feeds the same per-city counts can be computed straight off the shards
+# (each starts a process pool over every shard, so only when the feeds were just loaded)
+if sharded_feeds and reload_sources:
+    shards = discover_shards(FEEDS_DIR)
+    print(sharded_distinct(shards["providers_foodlisting"], ["City"], "Provider_ID")
+          .merge(sharded_distinct(shards["receivers_claims"], ["City"], "Receiver_ID"), on="City", how="outer"))
+    # Or approximately: one set of sketches per shard, merged
+    shard_sketches = merge_sketch_sets(
+        map_reduce(shards[table], functools.partial(sketch_file, table=table), merge_sketch_sets)
+        for table in ("providers_foodlisting", "receivers_claims")
+    )
+    print("Approximate distinct providers/receivers across shards:",
+          shard_sketches[("distinct_providers", "*", "*")].count(),
+          shard_sketches[("distinct_receivers", "*", "*")].count())
+
+# Approximate per-city counts from the stored sketches, without scanning the tables
+approx_per_city = approx_distinct_by_city(conn, "distinct_providers").merge(
+    approx_distinct_by_city(conn, "distinct_receivers"), on="City", how="outer").fillna(0).astype({"distinct_providers": int, "distinct_receivers": int})
+print("Approximate counts per city:\n", approx_per_city)
+
 # Get total number of food providers
 query = """
 SELECT COUNT(DISTINCT Provider_ID) AS Total_Food_Providers
@@ -107,6 +202,11 @@ FROM receivers_claims
 total_receivers = pd.read_sql_query(query, conn)
 print("Total Food Receivers:", total_receivers) 
 
+approx_providers, providers_error = approx_distinct(conn, "distinct_providers")
+approx_receivers, receivers_error = approx_distinct(conn, "distinct_receivers")
+print(f"Approximate Total Food Providers: {approx_providers} (±{providers_error:.1%})")
+print(f"Approximate Total Food Receivers: {approx_receivers} (±{receivers_error:.1%})")
+
 # 2. What is the contact information of food providers in a specific city?
 print("\n--- Question 2: Contact information of food providers in a specific city ---\n")
 city = 'New Jessica'  # Example city
@@ -131,14 +231,8 @@ print(result)
 
 # 4. Which receivers have claimed the most food?
 print("\n--- Question 4: Which receivers have claimed the most food? ---\n")
-most_claimed_receivers_query = """
-SELECT T1.Receiver_ID, T1.Name, T1.City, COUNT(*) AS Claim_Count
-FROM receivers_claims AS T1
-GROUP BY T1.Receiver_ID, T1.Name, T1.City
-ORDER BY Claim_Count DESC
-LIMIT 1
-"""
-result = pd.read_sql_query(most_claimed_receivers_query, conn)
+# Read from the receiver_claims leaderboard instead of grouping every claim
+result = pd.DataFrame(top_k(conn, "receiver_claims", 1), columns=["Receiver_ID", "Name", "Claim_Count"])
 print(result)
 
 
@@ -223,14 +317,7 @@ print(result)
 
 # 12. Which provider has the most successful claims?
 print("\n--- Question 12: Provider with the most successful claims ---\n")
-query = """SELECT pf.Provider_ID, pf.Name, COUNT(*) AS successful_claims
-FROM providers_foodlisting pf
-JOIN receivers_claims rc ON pf.Food_ID = rc.Food_ID
-WHERE rc.Status = 'Completed'
-GROUP BY pf.Provider_ID, pf.Name
-ORDER BY successful_claims DESC
-LIMIT 1;"""
-result = pd.read_sql_query(query, conn)
+result = pd.DataFrame(top_k(conn, "provider_completed_claims", 1), columns=["Provider_ID", "Name", "successful_claims"])
 print(result)
 
 
@@ -248,12 +335,7 @@ print(result)
 
 # 14. Which food item has the highest number of claims?
 print("\n--- Question 14: Food item with the highest number of claims ---\n")
-query = """SELECT Food_ID, COUNT(*) AS num_claims
-FROM receivers_claims
-GROUP BY Food_ID
-ORDER BY num_claims DESC
-LIMIT 1;"""
-result = pd.read_sql_query(query, conn)
+result = pd.DataFrame(top_k(conn, "food_claims", 1), columns=["Food_ID", "Food_Name", "num_claims"])
 print(result)
 
 # 15. What is the percentage of claims by status?
@@ -277,6 +359,9 @@ FROM receivers_claims
 GROUP BY Name;"""
 result = pd.read_sql_query(query, conn)
 print(result)
+# Same average with the distinct receivers taken from the sketch
+total_claim_rows = pd.read_sql_query("SELECT COUNT(*) AS n FROM receivers_claims", conn)['n'][0]
+print(f"Approximate average claims per receiver: {total_claim_rows / max(approx_receivers, 1):.2f} (±{receivers_error:.1%})")
 
 # 17. What is the most common meal type claimed by receivers?
 print("\n--- Question 17: Most common meal type claimed by receivers ---\n")
@@ -293,16 +378,7 @@ print(result)
 
 # 18. What is the total quantity of food donated by each provider?
 print("\n--- Question 18: What is the total quantity of food donated by each provider? ---\n")
-total_food_donated_by_provider_query = """
-SELECT T1.Provider_ID, SUM(T1.Quantity) AS Total_Food_Donated
-FROM providers_foodlisting AS T1
-INNER JOIN receivers_claims AS T2 ON T1.Food_ID = T2.Food_ID
-WHERE T2.Status = 'Completed'
-GROUP BY T1.Provider_ID
-ORDER BY Total_Food_Donated DESC
-LIMIT 10
-"""
-result = pd.read_sql_query(total_food_donated_by_provider_query, conn)
+result = pd.DataFrame(top_k(conn, "provider_quantity_donated", 10), columns=["Provider_ID", "Name", "Total_Food_Donated"])
 print(result)
 
 
@@ -428,36 +504,72 @@ st.markdown(
 DB_PATH = ('food_waste.db')
 
 import sqlite3
-def get_connection():
-    """Create a connection to the SQLite database."""
+def get_connection(as_of=None):
+    """Create a connection to the SQLite database, optionally reading the tables as of a past time."""
     conn = sqlite3.connect(DB_PATH)
+    if as_of is not None:
+        attach_as_of(conn, as_of)
     return conn
 
-def run_query(query):
-    conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql_query(query, conn)
+st.title("Food Waste Management Dashboard") 
+
+# --- Time Travel ---
+# Every panel below reads the listing and claim tables as they were at the chosen time
+st.sidebar.header("Time Travel")
+view_as_of = None
+if st.sidebar.checkbox("View past state"):
+    conn = get_connection()
+    history_start, history_end = history_range(conn)
+    conn.close()
+    if history_start is None:
+        st.sidebar.info("No history recorded yet.")
+    else:
+        as_of_date = st.sidebar.date_input(
+            "As of (end of day, UTC)",
+            value=pd.Timestamp(history_end).date(),
+            min_value=pd.Timestamp(history_start).date(),
+        )
+        view_as_of = pd.Timestamp(as_of_date) + pd.Timedelta(days=1) - pd.Timedelta(milliseconds=1)
+        st.info(f"Showing data as of {as_of_date} (UTC). Edits still apply to the current data.")
+
+def run_query(query, params=None):
+    conn = get_connection(view_as_of)
+    df = pd.read_sql_query(query, conn, params=params)
     conn.close()
     return df
 
-st.title("Food Waste Management Dashboard") 
+# --- Approximate Counts ---
+# Distinct counts and top claimed items from the sketches instead of full scans
+approximate_counts = st.sidebar.checkbox(
+    "Approximate counts",
+    help="Read distinct counts and heavy hitters from HyperLogLog / count-min sketches. Not available for past states.",
+)
+approximate_counts = approximate_counts and view_as_of is None
 
 # KPI Section
 st.header("Key Performance Indicators (KPIs)")
 # Get KPI values from your database
-total_providers = run_query("SELECT COUNT(DISTINCT Provider_ID) AS count FROM providers_foodlisting")['count'][0]
-total_receivers = run_query("SELECT COUNT(DISTINCT Receiver_ID) AS count FROM receivers_claims")['count'][0]
+if approximate_counts:
+    conn = get_connection()
+    total_providers, providers_error = approx_distinct(conn, "distinct_providers")
+    total_receivers, receivers_error = approx_distinct(conn, "distinct_receivers")
+    conn.close()
+else:
+    total_providers = run_query("SELECT COUNT(DISTINCT Provider_ID) AS count FROM providers_foodlisting")['count'][0]
+    total_receivers = run_query("SELECT COUNT(DISTINCT Receiver_ID) AS count FROM receivers_claims")['count'][0]
 total_listings = run_query("SELECT COUNT(*) AS count FROM providers_foodlisting")['count'][0]
 total_claims = run_query("SELECT COUNT(*) AS count FROM receivers_claims")['count'][0]
 total_food_available = run_query("SELECT SUM(Quantity) AS total FROM providers_foodlisting")['total'][0]
 claims_completed = run_query("SELECT COUNT(*) AS count FROM receivers_claims WHERE Status='Completed'")['count'][0]
 claims_completion_rate = (claims_completed / total_claims * 100) if total_claims else 0
 
-def kpi_card(label, value):
+def kpi_card(label, value, accuracy=None):
+    accuracy_line = f'<br><span style="color:#5a6275; font-size:13px;">{accuracy}</span>' if accuracy else ""
     st.markdown(
         f"""
         <div style="background-color:#f0f4f8; padding:20px; border-radius:10px; text-align:center; margin-bottom:10px;">
             <span style="color:#030838; font-size:18px; font-weight:bold;">{label}</span><br>
-            <span style="color:#030838; font-size:32px; font-weight:bold;">{value}</span>
+            <span style="color:#030838; font-size:32px; font-weight:bold;">{value}</span>{accuracy_line}
         </div>
         """,
         unsafe_allow_html=True
@@ -465,8 +577,13 @@ def kpi_card(label, value):
 
 col1, col2, col3 = st.columns(3)
 with col1:
-    kpi_card("Total Providers", total_providers)
-    kpi_card("Total Receivers", total_receivers)
+    if approximate_counts:
+        # ~95% of estimates fall within two standard errors
+        kpi_card("Total Providers", f"≈ {total_providers:,}", f"approximate, ±{2 * providers_error:.1%}")
+        kpi_card("Total Receivers", f"≈ {total_receivers:,}", f"approximate, ±{2 * receivers_error:.1%}")
+    else:
+        kpi_card("Total Providers", total_providers)
+        kpi_card("Total Receivers", total_receivers)
 with col2:
     kpi_card("Total Listings", total_listings)
     kpi_card("Total Claims", total_claims)
@@ -474,18 +591,124 @@ with col3:
     kpi_card("Food Available", int(total_food_available) if total_food_available else 0)
     kpi_card("Claims Completion Rate", f"{claims_completion_rate:.1f}%")
 
-def run_query(query, params=None):
+if approximate_counts:
+    st.subheader("Most Claimed Food Items and Contacts (Approximate)")
     conn = get_connection()
-    df = pd.read_sql_query(query, conn, params=params)
+    top_foods, foods_bound = heavy_hitters(conn, "food_claims", 10)
+    top_contacts, _ = heavy_hitters(conn, "contact_claims", 10)
     conn.close()
-    return df
+    col1, col2 = st.columns(2)
+    with col1:
+        st.dataframe(top_foods.rename(columns={"Value": "Food_ID"}))
+    with col2:
+        st.dataframe(top_contacts.rename(columns={"Value": "Contact"}))
+    st.caption(f"Counts are never low and, with probability {1 - SKETCH_COUNT_DELTA:.0%}, "
+               f"at most {foods_bound:.1f} claims too high.")
+
+def leaderboard(board, columns, k=10, board_city=ALL_CITIES):
+    """Top-k rows of a leaderboard as a DataFrame with the given column names."""
+    conn = get_connection(view_as_of)
+    # The rollup only holds current rankings, past states are computed from the as-of tables
+    rows = top_k(conn, board, k, board_city) if view_as_of is None else compute_top_k(conn, board, k, board_city)
+    conn.close()
+    return pd.DataFrame(rows, columns=columns)
+
+def leaderboard_scores(board, entities, board_city=ALL_CITIES):
+    """Scores of the given entities on a board, as {Entity: Score}."""
+    conn = get_connection(view_as_of)
+    if view_as_of is None:
+        result = scores(conn, board, entities, board_city)
+    else:
+        wanted = {str(e) for e in entities}
+        result = {e: score for e, _label, score in compute_top_k(conn, board, -1, board_city) if e in wanted}
+    conn.close()
+    return result
 
 def get_unique_values(column, table):
-    conn = get_connection()
+    conn = get_connection(view_as_of)
     df = pd.read_sql_query(f"SELECT DISTINCT {column} FROM {table}", conn)
     conn.close()
     return df[column].dropna().tolist()
 
+def get_listing_version():
+    """Cheap fingerprint of the listing table, changes on every add, update, delete or claim."""
+    # Read from the base table: the as-of views have no rowid
+    conn = get_connection()
+    row = conn.execute("SELECT COUNT(*), COALESCE(SUM(Version), 0), COALESCE(MAX(rowid), 0) FROM providers_foodlisting").fetchone()
+    conn.close()
+    return tuple(int(value) for value in row)
+
+# Each index holds a copy of the listings, so only the latest ones are kept
+@st.cache_resource(max_entries=2)
+def get_listing_index(listing_version, as_of):
+    """Spatial index over the listings (as of `as_of`), rebuilt only when the listing table changes."""
+    return build_listing_index(run_query("SELECT * FROM providers_foodlisting"))
+
+# A rebuilt index replaces the old one; the second slot serves a past view next to the current one
+@st.cache_resource(max_entries=2)
+def get_search_index(index_version, as_of):
+    """Fuzzy search index over provider, food, address and receiver names."""
+    listings = run_query("SELECT Name, Food_ID, Food_Name, Address FROM providers_foodlisting")
+    claims = run_query("SELECT Receiver_ID, Name FROM receivers_claims")
+    return build_search_index(listings, claims)
+
+def get_data_version():
+    """Cache key for derived data: latest change to the listing/claim tables and the time-travel point."""
+    conn = get_connection()
+    version = data_version(conn)
+    conn.close()
+    return version, str(view_as_of)
+
+@st.cache_data(max_entries=64)
+def cached_query(query, version):
+    """Query result, rerun only when the data version changes."""
+    return run_query(query)
+
+@st.cache_data(max_entries=64)
+def bar_chart_data(query, label, value, version, max_bars):
+    """Top groups of a grouped query plus an "Other" bar, sized for the browser."""
+    return prepare_bar_chart(cached_query(query, version), label, value, max_bars)
+
+@st.cache_data(max_entries=64)
+def distribution_data(query, value, version, name):
+    """Power-of-two histogram of a long-tailed count column."""
+    return log_bins(cached_query(query, version)[value], name).set_index("Bin")
+
+def paged_dataframe(df, key):
+    """Show a long table one page at a time; only the current page is sent to the browser."""
+    pages = table_page(df)[1]
+    page = 1
+    if pages > 1:
+        # The table may have shrunk since the page was picked
+        if st.session_state.get(key, 1) > pages:
+            st.session_state[key] = pages
+        page = st.number_input(f"Page (of {pages}, {TABLE_PAGE_ROWS} rows each)", min_value=1, max_value=pages, value=1, key=key)
+    st.dataframe(table_page(df, page)[0])
+
+def current_search_index():
+    # Only changes to the indexed names and addresses rebuild the index, not claims or quantities
+    conn = get_connection()
+    index_version = search_version(conn)
+    conn.close()
+    return get_search_index(index_version, str(view_as_of))
+
+def search_listings(df, search_text, limit=50):
+    """Rows of df whose provider name, food name or address match the search, best match first."""
+    if not search_text:
+        return df
+    results = current_search_index().search(search_text, limit=limit)
+    matches = []
+    for kind, key in zip(results["Kind"], results["Key"]):
+        if kind == "provider":
+            matches.append(df[df["Name"] == key])
+        elif kind == "food":
+            matches.append(df[df["Food_Name"] == key])
+        elif kind == "address":
+            matches.append(df[df["Food_ID"] == key])
+    if not matches:
+        return df.iloc[0:0]
+    return pd.concat(matches).drop_duplicates()
+
 # Implementing reminders and notifications for food providers and receivers.
 
 import datetime
@@ -506,9 +729,28 @@ if pending_claims > 0:
 # --- Sidebar Filters ---
 st.sidebar.header("Filters")
 city = st.sidebar.selectbox("City", ["All"] + get_unique_values("City", "providers_foodlisting"))
-provider = st.sidebar.selectbox("Provider", ["All"] + get_unique_values("Name", "providers_foodlisting"))
+provider_search = st.sidebar.text_input("Search Provider")
+if provider_search:
+    provider_options = current_search_index().search_keys(provider_search, "provider", limit=50)
+else:
+    provider_options = get_unique_values("Name", "providers_foodlisting")
+provider = st.sidebar.selectbox("Provider", ["All"] + provider_options)
 food_type = st.sidebar.selectbox("Food Type", ["All"] + get_unique_values("Food_Type", "providers_foodlisting"))
 meal_type = st.sidebar.selectbox("Meal Type", ["All"] + get_unique_values("Meal_Type", "providers_foodlisting"))
+st.sidebar.subheader("Nearby Listings")
+receiver_search = st.sidebar.text_input("Search Receiver")
+if receiver_search:
+    receiver_options = current_search_index().search_keys(receiver_search, "receiver", limit=50)
+else:
+    receiver_options = get_unique_values("Receiver_ID", "receivers_claims")
+near_receiver = st.sidebar.selectbox("Near Receiver", ["None"] + receiver_options)
+radius_km = st.sidebar.slider("Radius (km)", min_value=1, max_value=200, value=25)
+# Same as-of date as the load validation; the bundled data is a snapshot, so today would hide everything
+hide_expired = st.sidebar.checkbox(f"Hide listings expired by {EXPIRY_AS_OF}", value=True)
+st.sidebar.subheader("Leaderboards and Charts")
+leaderboard_size = st.sidebar.slider("Show top", min_value=5, max_value=100, value=10)
+# Boards follow the City filter; kept separately because the CRUD forms reuse `city`
+board_city = ALL_CITIES if city == "All" else city
 
 # --- Query Filters ---
 filters = []
@@ -532,7 +774,25 @@ df = run_query(query)
 if df.empty:
     st.warning("No food listings found with the selected filters.")
 else:   
-    st.dataframe(df)
+    paged_dataframe(df, "page_listings")
+
+# Open listings within the radius of the selected receiver, soonest expiry first
+if near_receiver != "None":
+    st.subheader(f"Open Listings within {radius_km} km of Receiver {near_receiver}")
+    receiver_city = run_query("SELECT City FROM receivers_claims WHERE Receiver_ID = ? LIMIT 1", (near_receiver,))['City'][0]
+    lat, lon = receiver_coordinates(receiver_city, near_receiver)
+    is_open = open_listing_filter(EXPIRY_AS_OF if hide_expired else None)
+    def nearby_filter(row):
+        if food_type != "All" and row["Food_Type"] != food_type:
+            return False
+        if meal_type != "All" and row["Meal_Type"] != meal_type:
+            return False
+        return is_open(row)
+    nearby = get_listing_index(get_listing_version(), str(view_as_of)).within(lat, lon, radius_km, predicate=nearby_filter)
+    if nearby.empty:
+        st.info("No open listings found near this receiver.")
+    else:
+        st.dataframe(nearby[["Food_ID", "Food_Name", "Name", "City", "Address", "Remaining_Quantity", "Expiry_Date", "Distance_km"]])
 
 
 # Provider Contact Details
@@ -545,7 +805,7 @@ provider_contacts = run_query(provider_contact_query)
 if provider_contacts.empty:
     st.info("No providers found with the selected filters.")
 else:
-    st.dataframe(provider_contacts)
+    paged_dataframe(provider_contacts, "page_provider_contacts")
 
 # Receiver Contact Details
 st.subheader("Receiver Contact Details")
@@ -558,7 +818,30 @@ receiver_contacts = run_query(receiver_contact_query)
 if receiver_contacts.empty:
     st.info("No receivers found with the selected filters.")
 else:
-    st.dataframe(receiver_contacts)
+    paged_dataframe(receiver_contacts, "page_receiver_contacts")
+
+# Expected Demand
+st.subheader("Expected Demand (Next 7 Days)")
+forecast_filters = []
+forecast_params = []
+if city != "All":
+    forecast_filters.append("City = ?")
+    forecast_params.append(city)
+if food_type != "All":
+    forecast_filters.append("Food_Type = ?")
+    forecast_params.append(food_type)
+forecast_query = f"""
+SELECT Forecast_Date, Food_Type, SUM(Expected_Claims) AS Expected_Claims
+FROM demand_forecasts
+{"WHERE " + " AND ".join(forecast_filters) if forecast_filters else ""}
+GROUP BY Forecast_Date, Food_Type
+ORDER BY Forecast_Date
+"""
+expected_demand = run_query(forecast_query, forecast_params)
+if expected_demand.empty:
+    st.info("No demand forecast available for the selected filters.")
+else:
+    st.line_chart(expected_demand.pivot(index="Forecast_Date", columns="Food_Type", values="Expected_Claims"))
 
 
 
@@ -567,10 +850,23 @@ else:
 
 
 
+# Data Quality
+st.subheader("Quarantined Rows")
+quarantine_summary = run_query("""
+SELECT Source_Table, Reasons, COUNT(*) AS num_rows
+FROM quarantine
+GROUP BY Source_Table, Reasons
+ORDER BY num_rows DESC
+""")
+if quarantine_summary.empty:
+    st.success("All loaded rows passed validation.")
+else:
+    st.dataframe(quarantine_summary)
+
 # --- CRUD Operations ---
 st.header("CRUD Operations")
 
-crud_tab = st.tabs(["Add Provider", "Update Provider", "Delete Provider"],)
+crud_tab = st.tabs(["Add Provider", "Update Provider", "Delete Provider", "Claim Food"],)
 
 with crud_tab[0]:
     st.subheader("Add Provider")
@@ -582,18 +878,24 @@ with crud_tab[0]:
         meal_type = st.text_input("Meal Type")
         quantity = st.number_input("Quantity", min_value=1)
         if st.form_submit_button("Add"):
-            conn = get_connection()
-            conn.execute(
-                "INSERT INTO providers_foodlisting (Name, City, Contact, Food_Type, Meal_Type, Quantity) VALUES (?, ?, ?, ?, ?, ?)",
-                (name, city, contact, food_type, meal_type, quantity)
-            )
-            conn.commit()
-            conn.close()
-            st.success("Provider added!")
+            if not name.strip() or not city.strip():
+                st.error("Name and City are required.")
+            else:
+                conn = get_connection()
+                # New listings get the next Provider_ID and Food_ID instead of NULL IDs
+                conn.execute(
+                    "INSERT INTO providers_foodlisting (Provider_ID, Food_ID, Name, City, Location, Contact, Food_Type, Meal_Type, Quantity, Remaining_Quantity) "
+                    "SELECT COALESCE(MAX(Provider_ID), 0) + 1, COALESCE(MAX(Food_ID), 0) + 1, ?, ?, ?, ?, ?, ?, ?, ? FROM providers_foodlisting",
+                    (name, city, city, contact, food_type, meal_type, quantity, quantity)
+                )
+                conn.commit()
+                conn.close()
+                st.success("Provider added!")
 
 with crud_tab[1]:
     st.subheader("Update Provider")
     df = run_query("SELECT * FROM providers_foodlisting")
+    df = search_listings(df, st.text_input("Search by provider, food or address", key="update_search"))
     selected = st.selectbox("Select Provider to Update", df["Provider_ID"].tolist())
     if selected:
         row = df[df["Provider_ID"] == selected].iloc[0]
@@ -607,8 +909,10 @@ with crud_tab[1]:
             if st.form_submit_button("Update"):
                 conn = get_connection()
                 conn.execute(
-                    "UPDATE providers_foodlisting SET Name=?, City=?, Contact=?, Food_Type=?, Meal_Type=?, Quantity=? WHERE Provider_ID=?",
-                    (name, city, contact, food_type, meal_type, quantity, selected)
+                    # Remaining quantity moves by the same amount as the listed quantity
+                    "UPDATE providers_foodlisting SET Name=?, City=?, Contact=?, Food_Type=?, Meal_Type=?, Quantity=?, "
+                    "Remaining_Quantity=MAX(Remaining_Quantity + ? - Quantity, 0), Version=Version+1 WHERE Provider_ID=?",
+                    (name, city, contact, food_type, meal_type, quantity, quantity, selected)
                 )
                 conn.commit()
                 conn.close()
@@ -617,6 +921,7 @@ with crud_tab[1]:
 with crud_tab[2]:
     st.subheader("Delete Provider")
     df = run_query("SELECT * FROM providers_foodlisting")
+    df = search_listings(df, st.text_input("Search by provider, food or address", key="delete_search"))
     selected = st.selectbox("Select Provider to Delete", df["Provider_ID"].tolist())
     if st.button("Delete"):
         conn = get_connection()
@@ -625,22 +930,41 @@ with crud_tab[2]:
         conn.close()
         st.success("Provider deleted!")
 
+with crud_tab[3]:
+    st.subheader("Claim Food")
+    df = run_query("SELECT Food_ID, Food_Name, Name, City, Address, Remaining_Quantity FROM providers_foodlisting WHERE Remaining_Quantity > 0")
+    df = search_listings(df, st.text_input("Search by provider, food or address", key="claim_search"))
+    with st.form("claim_food"):
+        food_id = st.selectbox("Select Food to Claim", df["Food_ID"].tolist())
+        receiver_id = st.number_input("Receiver ID", min_value=1, step=1)
+        claim_quantity = st.number_input("Quantity", min_value=1, step=1)
+        if st.form_submit_button("Claim"):
+            # Uses its own connection because reserve_claim manages the transaction
+            claim_conn = get_claim_connection(DB_PATH)
+            status, claim_id = reserve_claim(claim_conn, int(receiver_id), int(food_id), int(claim_quantity))
+            claim_conn.close()
+            if status == RESERVED:
+                st.success(f"Claim {claim_id} reserved!")
+            elif status == CONFLICT:
+                st.error("Not enough quantity left on this listing, it may have just been claimed by someone else.")
+            else:
+                st.error("Listing no longer exists.")
+
 # --- Visualize the data analysis with the help of charts ---
+# Charts show the top groups plus an "Other" bar; grouped results are cached
+# until the data changes. Read after the CRUD forms so their edits show up.
+chart_bars = leaderboard_size + 1
+chart_version = get_data_version()
 # Exapmple 1: The most frequent food providers and their contributions. 
 
 st.header("1. Food Providers and Their Contributions")
-query1 = """
-SELECT Name, COUNT(*) AS num_listings, SUM(Quantity) AS total_contributed
-FROM providers_foodlisting
-GROUP BY Name
-ORDER BY num_listings DESC, total_contributed DESC;
-"""
-df1 = run_query(query1)
+df1 = leaderboard("provider_listings", ["Name", "Label", "num_listings"], leaderboard_size, board_city)[["Name", "num_listings"]]
+df1["total_contributed"] = df1["Name"].map(leaderboard_scores("provider_listed_quantity", df1["Name"], board_city))
 st.dataframe(df1)
 # Bar chart for food providers
 
 st.subheader("Bar Chart: Food Providers Contributions")
-st.bar_chart(df1.set_index('Name')['total_contributed'])
+st.bar_chart(prepare_bar_chart(df1, 'Name', 'total_contributed', chart_bars))
 
 # Exampe 2: The highest demand locations based on food claims. 
 
@@ -651,9 +975,9 @@ FROM receivers_claims
 GROUP BY City
 ORDER BY total_claims DESC;
 """
-df2 = run_query(query2)
-st.dataframe(df2)
-st.bar_chart(df2.set_index('City')['total_claims'])
+df2 = cached_query(query2, chart_version)
+paged_dataframe(df2, "page_2")
+st.bar_chart(bar_chart_data(query2, 'City', 'total_claims', chart_version, chart_bars))
 
 
 # Example 3: Food Types Distribution
@@ -747,33 +1071,20 @@ st.bar_chart(df8.set_index('Type'))
 # Example 9: Claims by Provider
 
 st.header("9. Claims by Provider")
-query9 = """
-SELECT pf.Provider_ID, pf.Name, COUNT(*) AS num_claims
-FROM providers_foodlisting pf
-JOIN receivers_claims rc ON pf.Food_ID = rc.Food_ID
-GROUP BY pf.Provider_ID, pf.Name
-ORDER BY num_claims DESC;
-"""
-df9 = run_query(query9)
+df9 = leaderboard("provider_claims", ["Provider_ID", "Name", "num_claims"], leaderboard_size, board_city)
 st.dataframe(df9)
 # Bar chart for claims by provider
 st.subheader("Bar Chart: Claims by Provider")
-st.bar_chart(df9.set_index('Name'))
+st.bar_chart(prepare_bar_chart(df9, 'Name', 'num_claims', chart_bars))
 
 # Example 10: Claims by Receiver
 
 st.header("10. Claims by Receiver")
-query10 = """
-SELECT rc.Receiver_ID, rc.Name, COUNT(*) AS num_claims
-FROM receivers_claims rc
-GROUP BY rc.Receiver_ID, rc.Name
-ORDER BY num_claims DESC;
-"""
-df10 = run_query(query10)
+df10 = leaderboard("receiver_claims", ["Receiver_ID", "Name", "num_claims"], leaderboard_size, board_city)
 st.dataframe(df10)
 # Bar chart for claims by receiver
 st.subheader("Bar Chart: Claims by Receiver")
-st.bar_chart(df10.set_index('Name'))
+st.bar_chart(prepare_bar_chart(df10, 'Name', 'num_claims', chart_bars))
 
 # Example 11: Claims by Food Item
 
@@ -784,11 +1095,14 @@ FROM receivers_claims
 GROUP BY Food_ID
 ORDER BY num_claims DESC;
 """
-df11 = run_query(query11)
-st.dataframe(df11)
+df11 = cached_query(query11, chart_version)
+paged_dataframe(df11, "page_11")
 # Bar chart for claims by food item
 st.subheader("Bar Chart: Claims by Food Item")
-st.bar_chart(df11.set_index('Food_ID'))
+st.bar_chart(bar_chart_data(query11, 'Food_ID', 'num_claims', chart_version, chart_bars))
+if len(df11) > chart_bars:
+    st.subheader("Distribution: Food Items by Number of Claims")
+    st.bar_chart(distribution_data(query11, 'num_claims', chart_version, 'num_food_items'))
 
 # Example 12: Claims by Provider City
 
@@ -800,11 +1114,11 @@ JOIN receivers_claims rc ON pf.Food_ID = rc.Food_ID
 GROUP BY pf.City
 ORDER BY num_claims DESC;
 """
-df12 = run_query(query12)
-st.dataframe(df12)
+df12 = cached_query(query12, chart_version)
+paged_dataframe(df12, "page_12")
 # Bar chart for claims by provider city
 st.subheader("Bar Chart: Claims by Provider City")
-st.bar_chart(df12.set_index('City'))
+st.bar_chart(bar_chart_data(query12, 'City', 'num_claims', chart_version, chart_bars))
 
 # Example 13: Claims by Receiver City
 st.header("13. Claims by Receiver City")
@@ -814,11 +1128,11 @@ FROM receivers_claims rc
 GROUP BY rc.City
 ORDER BY num_claims DESC;
 """ 
-df13 = run_query(query13)
-st.dataframe(df13)
+df13 = cached_query(query13, chart_version)
+paged_dataframe(df13, "page_13")
 # Bar chart for claims by receiver city
 st.subheader("Bar Chart: Claims by Receiver City")
-st.bar_chart(df13.set_index('City'))
+st.bar_chart(bar_chart_data(query13, 'City', 'num_claims', chart_version, chart_bars))
 
 # Example 14: Claims by Provider Contact
 
@@ -831,11 +1145,14 @@ JOIN receivers_claims rc ON pf.Food_ID = rc.Food_ID
 GROUP BY pf.Contact
 ORDER BY num_claims DESC;
 """
-df14 = run_query(query14)
-st.dataframe(df14)
+df14 = cached_query(query14, chart_version)
+paged_dataframe(df14, "page_14")
 # Bar chart for claims by provider contact
 st.subheader("Bar Chart: Claims by Provider Contact")
-st.bar_chart(df14.set_index('Contact'))
+st.bar_chart(bar_chart_data(query14, 'Contact', 'num_claims', chart_version, chart_bars))
+if len(df14) > chart_bars:
+    st.subheader("Distribution: Provider Contacts by Number of Claims")
+    st.bar_chart(distribution_data(query14, 'num_claims', chart_version, 'num_contacts'))
 
 # Example 15: Claims by Receiver Contact
 
@@ -846,11 +1163,14 @@ FROM receivers_claims rc
 GROUP BY rc.Contact 
 ORDER BY num_claims DESC;
 """
-df15 = run_query(query15)
-st.dataframe(df15)
+df15 = cached_query(query15, chart_version)
+paged_dataframe(df15, "page_15")
 # Bar chart for claims by receiver contact
 st.subheader("Bar Chart: Claims by Receiver Contact")
-st.bar_chart(df15.set_index('Contact'))
+st.bar_chart(bar_chart_data(query15, 'Contact', 'num_claims', chart_version, chart_bars))
+if len(df15) > chart_bars:
+    st.subheader("Distribution: Receiver Contacts by Number of Claims")
+    st.bar_chart(distribution_data(query15, 'num_claims', chart_version, 'num_contacts'))
 
 # Example 16: Claims by Provider Food Type
 st.header("16. Claims by Provider Food Type")
@@ -0,0 +1,83 @@
+# Chart data preparation
+#
+# A bar chart with one bar per provider, receiver, Food_ID or contact sends
+# every row to the browser on each rerun and draws thousands of unreadable
+# bars. The helpers here shrink a grouped result before it is charted:
+#   - top_n_with_other keeps the N largest groups and folds the rest into one
+#     "Other" bar, so the chart total stays the same
+#   - log_bins turns a long-tailed count column into a handful of
+#     power-of-two bins (how many groups have 1, 2, 3-4, 5-8, ... claims)
+#   - prepare_bar_chart applies both limits of a chart budget: at most
+#     `max_bars` bars and about `max_bytes` of data, shrinking N until it fits
+#   - table_page cuts a long table into pages of TABLE_PAGE_ROWS rows, so a
+#     table widget only sends the page being looked at
+# The dashboard caches the prepared frames keyed by the data version, so the
+# queries and the preparation only run again after the data changed.
+
+import numpy as np
+import pandas as pd
+
+OTHER_LABEL = "Other"
+MAX_BARS = 25
+MAX_BYTES = 20_000
+TABLE_PAGE_ROWS = 50
+
+
+def payload_bytes(df):
+    """Rough size of a frame once serialized for the browser."""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def top_n_with_other(df, label, value, n=MAX_BARS, other_label=OTHER_LABEL):
+    """The `n` largest rows by `value`, plus one row summing the rest (when there is a rest).
+
+    Returns a frame with the `label` and `value` columns only.
+    """
+    ranked = df[[label, value]].sort_values(value, ascending=False, kind="stable")
+    if len(ranked) <= n:
+        return ranked.reset_index(drop=True)
+    top = ranked.iloc[:n].copy()
+    top[label] = top[label].astype(str)
+    other = pd.DataFrame({label: [other_label], value: [ranked[value].iloc[n:].sum()]})
+    return pd.concat([top, other], ignore_index=True)
+
+
+def log_bins(values, name="count"):
+    """How many values fall in each power-of-two bin: 1, 2, 3-4, 5-8, ...
+
+    Values below 1 go to a "0" bin. Labels are zero padded so they also sort
+    in bin order as text.
+    """
+    values = pd.Series(values).dropna().astype(np.int64)
+    if values.empty:
+        return pd.DataFrame({"Bin": [], name: []})
+    exponent = np.ceil(np.log2(values.clip(lower=1))).astype(np.int64)
+    exponent = exponent.where(values > 0, -1)
+    counts = exponent.value_counts().sort_index()
+    width = len(str(2 ** int(counts.index.max()))) if counts.index.max() >= 0 else 1
+    labels = []
+    for e in counts.index:
+        if e < 0:
+            labels.append("0".zfill(width))
+            continue
+        lo, hi = (2 ** (e - 1) + 1 if e > 0 else 1), 2 ** e
+        labels.append(f"{lo:0{width}d}" if lo == hi else f"{lo:0{width}d}-{hi:0{width}d}")
+    return pd.DataFrame({"Bin": labels, name: counts.to_numpy()})
+
+
+def prepare_bar_chart(df, label, value, max_bars=MAX_BARS, max_bytes=MAX_BYTES):
+    """Chart-ready frame indexed by `label`: top-N plus "Other" within the bar and byte budgets."""
+    # With a folded tail one of the bars is "Other"
+    n = len(df) if len(df) <= max_bars else max(max_bars - 1, 1)
+    chart = top_n_with_other(df, label, value, n)
+    while n > 1 and payload_bytes(chart) > max_bytes:
+        n //= 2
+        chart = top_n_with_other(df, label, value, n)
+    return chart.set_index(label)
+
+
+def table_page(df, page=1, rows=TABLE_PAGE_ROWS):
+    """Rows of page `page` (counting from 1, clamped to the valid range) and the number of pages."""
+    pages = max(-(-len(df) // rows), 1)
+    page = min(max(int(page), 1), pages)
+    return df.iloc[(page - 1) * rows:page * rows], pages
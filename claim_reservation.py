@@ -0,0 +1,197 @@
+# Claim reservation for food listings
+#
+# A listing's Quantity is the amount the provider put up; Remaining_Quantity is
+# what is still free to claim. Reserving a claim checks and decrements
+# Remaining_Quantity and records the claim row in one IMMEDIATE transaction, so
+# two receivers can never both take the last portion of the same Food_ID.
+# Version is bumped on every decrement and can be used as a compare-and-swap
+# token by callers that read a listing before reserving it. The reserved amount
+# is kept on the claim row as Claimed_Quantity, so releasing a claim gives back
+# exactly what it took.
+
+import datetime
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+DB_PATH = ('food_waste.db')
+
+# How long a writer waits for the database lock before giving up (seconds)
+BUSY_TIMEOUT = 30
+
+RESERVED = "reserved"
+CONFLICT = "conflict"
+NOT_FOUND = "not_found"
+
+
+def get_connection(db_path=DB_PATH):
+    """Create a connection that waits on locks instead of failing straight away."""
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, isolation_level=None)
+    return conn
+
+
+def init_claim_schema(conn):
+    """Add the Remaining_Quantity and Version columns to the listing table and
+    Claimed_Quantity to the claim table if missing."""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(providers_foodlisting)")]
+    if "Remaining_Quantity" not in columns:
+        conn.execute("ALTER TABLE providers_foodlisting ADD COLUMN Remaining_Quantity INTEGER")
+        # Quantity already taken by completed or pending claims is not known per
+        # claim, so every existing listing starts with its full quantity.
+        conn.execute("UPDATE providers_foodlisting SET Remaining_Quantity = Quantity")
+    if "Version" not in columns:
+        conn.execute("ALTER TABLE providers_foodlisting ADD COLUMN Version INTEGER NOT NULL DEFAULT 0")
+    claim_columns = [row[1] for row in conn.execute("PRAGMA table_info(receivers_claims)")]
+    if "Claimed_Quantity" not in claim_columns:
+        # NULL for claims loaded from the CSVs: they were never taken off Remaining_Quantity
+        conn.execute("ALTER TABLE receivers_claims ADD COLUMN Claimed_Quantity INTEGER")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_listing_food_id ON providers_foodlisting (Food_ID)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_claims_claim_id ON receivers_claims (Claim_ID)")
+    conn.commit()
+
+
+def reserve_claim(conn, receiver_id, food_id, quantity=1, expected_version=None):
+    """Atomically reserve `quantity` of a listing for a receiver.
+
+    Returns (status, claim_id) where status is RESERVED, CONFLICT or NOT_FOUND.
+    When `expected_version` is given the reservation only succeeds if the
+    listing has not changed since the caller read it.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        sql = """
+        UPDATE providers_foodlisting
+        SET Remaining_Quantity = Remaining_Quantity - ?, Version = Version + 1
+        WHERE Food_ID = ? AND Remaining_Quantity >= ?
+        """
+        params = [quantity, food_id, quantity]
+        if expected_version is not None:
+            sql += " AND Version = ?"
+            params.append(expected_version)
+        cursor = conn.execute(sql, params)
+        if cursor.rowcount == 0:
+            exists = conn.execute(
+                "SELECT 1 FROM providers_foodlisting WHERE Food_ID = ?", (food_id,)
+            ).fetchone()
+            conn.execute("ROLLBACK")
+            return (CONFLICT if exists else NOT_FOUND), None
+
+        # Receiver details are stored on every claim row, copy them from an earlier claim
+        receiver = conn.execute(
+            "SELECT Name, Type, City, Contact FROM receivers_claims WHERE Receiver_ID = ? LIMIT 1",
+            (receiver_id,),
+        ).fetchone() or (None, None, None, None)
+        claim_id = conn.execute(
+            "SELECT COALESCE(MAX(Claim_ID), 0) + 1 FROM receivers_claims"
+        ).fetchone()[0]
+        timestamp = datetime.datetime.now().strftime("%H:%M:%S %d-%m-%Y")
+        conn.execute(
+            "INSERT INTO receivers_claims (Receiver_ID, Name, Type, City, Contact, Claim_ID, Food_ID, Status, Timestamp_formatted, Claimed_Quantity) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, 'Pending', ?, ?)",
+            (receiver_id, *receiver, claim_id, food_id, timestamp, quantity),
+        )
+        conn.execute("COMMIT")
+        return RESERVED, claim_id
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+
+
+def release_claim(conn, claim_id):
+    """Cancel a pending claim and give the quantity it reserved back to the listing."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT Food_ID, COALESCE(Claimed_Quantity, 0) FROM receivers_claims WHERE Claim_ID = ? AND Status = 'Pending'",
+            (claim_id,),
+        ).fetchone()
+        if row is None:
+            conn.execute("ROLLBACK")
+            return False
+        conn.execute("UPDATE receivers_claims SET Status = 'Cancelled' WHERE Claim_ID = ?", (claim_id,))
+        conn.execute(
+            "UPDATE providers_foodlisting SET Remaining_Quantity = Remaining_Quantity + ?, Version = Version + 1 WHERE Food_ID = ?",
+            (row[1], row[0]),
+        )
+        conn.execute("COMMIT")
+        return True
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+
+
+def stress_test(db_path=DB_PATH, food_id=None, workers=16, attempts_per_worker=50):
+    """Hammer one listing from many connections and check no update was lost.
+
+    Runs against a temporary copy of the database so the real data is untouched.
+    Returns a dict with the counts; raises AssertionError on a lost update.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    tmp_db = os.path.join(tmp_dir, "stress.db")
+    shutil.copy(db_path, tmp_db)
+    try:
+        conn = get_connection(tmp_db)
+        conn.execute("PRAGMA journal_mode=WAL")
+        init_claim_schema(conn)
+        if food_id is None:
+            food_id = conn.execute("SELECT Food_ID FROM providers_foodlisting LIMIT 1").fetchone()[0]
+        start_remaining = conn.execute(
+            "SELECT Remaining_Quantity FROM providers_foodlisting WHERE Food_ID = ?", (food_id,)
+        ).fetchone()[0]
+        start_claims = conn.execute("SELECT COUNT(*) FROM receivers_claims").fetchone()[0]
+        receiver_ids = [r[0] for r in conn.execute("SELECT DISTINCT Receiver_ID FROM receivers_claims LIMIT ?", (workers,))]
+        conn.close()
+
+        results = {RESERVED: 0, CONFLICT: 0}
+        lock = threading.Lock()
+
+        def worker(receiver_id):
+            worker_conn = get_connection(tmp_db)
+            counts = {RESERVED: 0, CONFLICT: 0}
+            for _ in range(attempts_per_worker):
+                status, _claim_id = reserve_claim(worker_conn, receiver_id, food_id)
+                counts[status] += 1
+            worker_conn.close()
+            with lock:
+                for key in counts:
+                    results[key] += counts[key]
+
+        threads = [threading.Thread(target=worker, args=(receiver_ids[i % len(receiver_ids)],)) for i in range(workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        conn = get_connection(tmp_db)
+        end_remaining = conn.execute(
+            "SELECT Remaining_Quantity FROM providers_foodlisting WHERE Food_ID = ?", (food_id,)
+        ).fetchone()[0]
+        new_claims = conn.execute("SELECT COUNT(*) FROM receivers_claims").fetchone()[0] - start_claims
+        duplicate_ids = conn.execute(
+            "SELECT COUNT(*) - COUNT(DISTINCT Claim_ID) FROM receivers_claims"
+        ).fetchone()[0]
+        conn.close()
+
+        expected_reserved = min(start_remaining, workers * attempts_per_worker)
+        assert end_remaining >= 0, "remaining quantity went negative"
+        assert results[RESERVED] == expected_reserved, "reservations do not match available quantity"
+        assert start_remaining - end_remaining == results[RESERVED], "lost update on Remaining_Quantity"
+        assert new_claims == results[RESERVED], "claim rows do not match reservations"
+        assert duplicate_ids == 0, "duplicate Claim_ID issued"
+        return {
+            "food_id": food_id,
+            "start_remaining": start_remaining,
+            "end_remaining": end_remaining,
+            "reserved": results[RESERVED],
+            "conflicts": results[CONFLICT],
+        }
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    print(stress_test())
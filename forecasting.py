@@ -0,0 +1,171 @@
+# Demand forecasting over claim history
+#
+# Claims are counted per day for every (City, Food_Type) pair, using the city of
+# the provider whose food was claimed, and the counts are laid out as one numpy
+# matrix with a row per series and a column per day. Every model below works on
+# the whole matrix at once, so fitting thousands of series costs about the same
+# Python overhead as fitting one: the only loop is over days (for smoothing) or
+# over the handful of candidate smoothing constants.
+#
+# Models:
+#   - simple exponential smoothing, with alpha picked per series from ALPHAS
+#   - seasonal naive, repeating the last SEASON days
+# Each series uses whichever model had the lower error on the last HOLDOUT days.
+#
+# init_forecasts records the data version the forecasts were fitted on and
+# only refits when it (or the horizon/holdout) changed, not on every rerun.
+
+import datetime
+
+import numpy as np
+import pandas as pd
+
+ALPHAS = (0.1, 0.3, 0.5, 0.8)
+SEASON = 7
+HOLDOUT = 7
+HORIZON = 7
+
+FORECAST_TABLE = "demand_forecasts"
+FORECAST_STATE_TABLE = "demand_forecast_state"
+
+
+def claim_history(conn):
+    """Claim dates with the provider city and food type of the claimed listing."""
+    history = pd.read_sql_query(
+        """
+        SELECT pf.City, pf.Food_Type, rc.Timestamp_formatted
+        FROM receivers_claims rc
+        JOIN providers_foodlisting pf ON pf.Food_ID = rc.Food_ID
+        """,
+        conn,
+    )
+    history["Claim_Date"] = pd.to_datetime(
+        history["Timestamp_formatted"], format="%H:%M:%S %d-%m-%Y", errors="coerce"
+    ).dt.normalize()
+    return history.dropna(subset=["Claim_Date"])
+
+
+def daily_series(history):
+    """Matrix of daily claim counts, one row per (City, Food_Type), zero filled."""
+    counts = history.groupby(["City", "Food_Type", "Claim_Date"]).size()
+    matrix = counts.unstack("Claim_Date", fill_value=0)
+    days = pd.date_range(history["Claim_Date"].min(), history["Claim_Date"].max(), freq="D")
+    return matrix.reindex(columns=days, fill_value=0).astype(np.float64)
+
+
+def exponential_smoothing(Y, alpha):
+    """One-step-ahead fitted values and final level for every row of Y.
+
+    alpha may be a scalar or one value per row.
+    """
+    alpha = np.broadcast_to(np.asarray(alpha, dtype=np.float64), (Y.shape[0],))
+    fitted = np.empty_like(Y)
+    level = Y[:, 0].copy()
+    for t in range(Y.shape[1]):
+        fitted[:, t] = level
+        level = alpha * Y[:, t] + (1 - alpha) * level
+    return fitted, level
+
+
+def fit_smoothing(Y):
+    """Pick the alpha with the lowest in-sample squared error per row, return (alpha, level)."""
+    errors = []
+    levels = []
+    for alpha in ALPHAS:
+        fitted, level = exponential_smoothing(Y, alpha)
+        errors.append(((Y - fitted) ** 2).sum(axis=1))
+        levels.append(level)
+    best = np.argmin(np.vstack(errors), axis=0)
+    rows = np.arange(Y.shape[0])
+    return np.asarray(ALPHAS)[best], np.vstack(levels)[best, rows]
+
+
+def smoothing_forecast(Y, horizon):
+    _alpha, level = fit_smoothing(Y)
+    return np.repeat(level[:, None], horizon, axis=1)
+
+
+def seasonal_naive_forecast(Y, horizon, season=SEASON):
+    """Repeat the last `season` days; fall back to the row mean on short history."""
+    if Y.shape[1] < season:
+        return np.repeat(Y.mean(axis=1, keepdims=True), horizon, axis=1)
+    last = Y[:, -season:]
+    reps = -(-horizon // season)
+    return np.tile(last, reps)[:, :horizon]
+
+
+MODELS = {
+    "exponential_smoothing": smoothing_forecast,
+    "seasonal_naive": seasonal_naive_forecast,
+}
+
+
+def forecast_matrix(Y, horizon=HORIZON, holdout=HOLDOUT):
+    """Forecast every row of Y, choosing the model per row by holdout error.
+
+    Returns (forecasts, model names per row).
+    """
+    names = list(MODELS)
+    if Y.shape[1] > holdout + 1:
+        train, test = Y[:, :-holdout], Y[:, -holdout:]
+        errors = np.vstack([
+            np.abs(MODELS[name](train, holdout) - test).mean(axis=1) for name in names
+        ])
+        best = np.argmin(errors, axis=0)
+    else:
+        best = np.zeros(Y.shape[0], dtype=int)
+    forecasts = np.stack([MODELS[name](Y, horizon) for name in names])
+    rows = np.arange(Y.shape[0])
+    return forecasts[best, rows], np.asarray(names)[best]
+
+
+def build_forecasts(history, horizon=HORIZON, holdout=HOLDOUT):
+    """Long format forecast table: City, Food_Type, Forecast_Date, Expected_Claims, Model."""
+    columns = ["City", "Food_Type", "Forecast_Date", "Expected_Claims", "Model"]
+    if history.empty:
+        return pd.DataFrame(columns=columns)
+    matrix = daily_series(history)
+    forecasts, models = forecast_matrix(matrix.to_numpy(), horizon, holdout)
+    start = matrix.columns[-1] + datetime.timedelta(days=1)
+    dates = pd.date_range(start, periods=horizon, freq="D").strftime("%Y-%m-%d")
+    n_series = len(matrix)
+    return pd.DataFrame({
+        "City": np.repeat(matrix.index.get_level_values("City").to_numpy(), horizon),
+        "Food_Type": np.repeat(matrix.index.get_level_values("Food_Type").to_numpy(), horizon),
+        "Forecast_Date": np.tile(np.asarray(dates), n_series),
+        "Expected_Claims": np.round(np.clip(forecasts, 0, None).ravel(), 2),
+        "Model": np.repeat(models, horizon),
+    }, columns=columns)
+
+
+def refit_forecasts(conn, horizon=HORIZON, holdout=HOLDOUT):
+    """Refit every series from the claim history and replace the forecast table."""
+    forecasts = build_forecasts(claim_history(conn), horizon, holdout)
+    forecasts.to_sql(FORECAST_TABLE, conn, if_exists="replace", index=False)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{FORECAST_TABLE}_city_type ON {FORECAST_TABLE} (City, Food_Type)")
+    conn.commit()
+    return forecasts
+
+
+def init_forecasts(conn, data_version, refit=False, horizon=HORIZON, holdout=HOLDOUT):
+    """Refit the forecasts when asked to or when they were fitted on other data or settings.
+
+    `data_version` is any value that changes with the claim and listing tables
+    (e.g. history.data_version). Returns the new forecasts, or None when the
+    stored ones are still current.
+    """
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {FORECAST_STATE_TABLE} (Data_Version TEXT, Horizon INTEGER, Holdout INTEGER)"
+    )
+    fitted = conn.execute(f"SELECT Data_Version, Horizon, Holdout FROM {FORECAST_STATE_TABLE}").fetchone()
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FORECAST_TABLE,)
+    ).fetchone()
+    current = (None if data_version is None else str(data_version), horizon, holdout)
+    if exists and not refit and fitted == current:
+        return None
+    forecasts = refit_forecasts(conn, horizon, holdout)
+    conn.execute(f"DELETE FROM {FORECAST_STATE_TABLE}")
+    conn.execute(f"INSERT INTO {FORECAST_STATE_TABLE} (Data_Version, Horizon, Holdout) VALUES (?, ?, ?)", current)
+    conn.commit()
+    return forecasts
@@ -0,0 +1,175 @@
+# Geo-spatial lookups for providers and receivers
+#
+# The datasets only carry City names (and a free text Address for providers), so
+# coordinates come from an offline gazetteer CSV when one is present, otherwise
+# from a synthetic lookup that hashes each City name to a stable point inside a
+# fixed region. Individual providers and receivers are spread a little around
+# their city centre so that listings in the same city are not all on one spot.
+#
+# Listings are bucketed into a uniform grid of GRID_KM sized cells. A radius
+# query only visits the cells that overlap the search circle, and each cell
+# keeps its listings sorted by expiry, so results come back in expiry order by
+# merging the visited cells instead of scanning and sorting the whole table.
+
+import hashlib
+import heapq
+import math
+import os
+
+import pandas as pd
+
+GAZETTEER_PATH = ('city_coordinates.csv')
+
+# Synthetic region used when a city is not in the gazetteer (lat/lon bounds)
+REGION = (38.0, 41.0, -80.0, -75.0)
+# Max distance of a provider/receiver from its city centre (km)
+CITY_SPREAD_KM = 3.0
+# Grid cell size (km)
+GRID_KM = 10.0
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG_LAT = 111.32
+
+
+def _unit_hash(text, salt=""):
+    """Map a string to two stable floats in [0, 1)."""
+    digest = hashlib.md5(f"{salt}{text}".encode("utf-8")).digest()
+    a = int.from_bytes(digest[:8], "big") / 2 ** 64
+    b = int.from_bytes(digest[8:], "big") / 2 ** 64
+    return a, b
+
+
+def load_gazetteer(path=GAZETTEER_PATH):
+    """Read City, Latitude, Longitude rows from a local CSV if it exists."""
+    if not os.path.exists(path):
+        return {}
+    df = pd.read_csv(path)
+    return {row.City: (row.Latitude, row.Longitude) for row in df.itertuples(index=False)}
+
+
+def city_coordinates(city, gazetteer=None):
+    """Return (lat, lon) for a city from the gazetteer or the synthetic lookup."""
+    if gazetteer and city in gazetteer:
+        return gazetteer[city]
+    lat_min, lat_max, lon_min, lon_max = REGION
+    a, b = _unit_hash(city, "city:")
+    return lat_min + a * (lat_max - lat_min), lon_min + b * (lon_max - lon_min)
+
+
+def point_coordinates(city, key, gazetteer=None):
+    """Place a provider/receiver identified by `key` near its city centre."""
+    lat, lon = city_coordinates(city, gazetteer)
+    a, b = _unit_hash(key, "point:")
+    # Uniform point in a disc of CITY_SPREAD_KM around the centre
+    r = CITY_SPREAD_KM * math.sqrt(a)
+    theta = 2 * math.pi * b
+    dlat = (r * math.cos(theta)) / KM_PER_DEG_LAT
+    dlon = (r * math.sin(theta)) / (KM_PER_DEG_LAT * math.cos(math.radians(lat)))
+    return lat + dlat, lon + dlon
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great circle distance between two points in km."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    h = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+
+def add_listing_coordinates(listings, gazetteer=None):
+    """Return a copy of the listings DataFrame with Latitude and Longitude columns."""
+    listings = listings.copy()
+    coords = [
+        point_coordinates(city, f"provider:{provider_id}:{address}", gazetteer)
+        for city, provider_id, address in zip(listings["City"], listings["Provider_ID"], listings["Address"])
+    ]
+    listings["Latitude"] = [c[0] for c in coords]
+    listings["Longitude"] = [c[1] for c in coords]
+    return listings
+
+
+def receiver_coordinates(city, receiver_id, gazetteer=None):
+    """Receivers have no address, so they are placed by City and Receiver_ID."""
+    return point_coordinates(city, f"receiver:{receiver_id}", gazetteer)
+
+
+class GridIndex:
+    """Uniform grid over listing coordinates with expiry-sorted cells."""
+
+    def __init__(self, listings, cell_km=GRID_KM):
+        self.cell_km = cell_km
+        self.cells = {}
+        self.rows = listings.reset_index(drop=True)
+        lats = self.rows["Latitude"].to_numpy()
+        lons = self.rows["Longitude"].to_numpy()
+        expiry = self.rows["Expiry_Date"].astype(str).to_numpy()
+        for i in range(len(self.rows)):
+            self.cells.setdefault(self._cell(lats[i], lons[i]), []).append((expiry[i], i, lats[i], lons[i]))
+        for bucket in self.cells.values():
+            bucket.sort()
+
+    def _cell(self, lat, lon):
+        # Longitude cells are scaled at the cell's latitude band so cells stay roughly square
+        row = int(math.floor(lat * KM_PER_DEG_LAT / self.cell_km))
+        band_lat = (row + 0.5) * self.cell_km / KM_PER_DEG_LAT
+        km_per_deg_lon = KM_PER_DEG_LAT * max(math.cos(math.radians(band_lat)), 1e-6)
+        col = int(math.floor(lon * km_per_deg_lon / self.cell_km))
+        return row, col
+
+    def _cells_in_radius(self, lat, lon, radius_km):
+        row_lo = int(math.floor((lat * KM_PER_DEG_LAT - radius_km) / self.cell_km))
+        row_hi = int(math.floor((lat * KM_PER_DEG_LAT + radius_km) / self.cell_km))
+        for row in range(row_lo, row_hi + 1):
+            band_lat = (row + 0.5) * self.cell_km / KM_PER_DEG_LAT
+            # Use the widest part of the band so no overlapping cell is missed
+            edge_lat = min(abs(band_lat) + self.cell_km / KM_PER_DEG_LAT, 89.9)
+            km_per_deg_lon = KM_PER_DEG_LAT * max(math.cos(math.radians(band_lat)), 1e-6)
+            deg_lon = radius_km / (KM_PER_DEG_LAT * max(math.cos(math.radians(edge_lat)), 1e-6))
+            col_lo = int(math.floor((lon - deg_lon) * km_per_deg_lon / self.cell_km))
+            col_hi = int(math.floor((lon + deg_lon) * km_per_deg_lon / self.cell_km))
+            for col in range(col_lo, col_hi + 1):
+                bucket = self.cells.get((row, col))
+                if bucket:
+                    yield bucket
+
+    def within(self, lat, lon, radius_km, limit=None, predicate=None):
+        """Listings within `radius_km` of (lat, lon), soonest expiry first.
+
+        `predicate` is an optional function taking a listing row (as a Series)
+        and returning False to skip it, e.g. to drop claimed-out listings.
+        """
+        picked = []
+        merged = heapq.merge(*self._cells_in_radius(lat, lon, radius_km))
+        for _expiry, i, p_lat, p_lon in merged:
+            distance = haversine_km(lat, lon, p_lat, p_lon)
+            if distance > radius_km:
+                continue
+            if predicate is not None and not predicate(self.rows.iloc[i]):
+                continue
+            picked.append((i, distance))
+            if limit is not None and len(picked) >= limit:
+                break
+        result = self.rows.iloc[[i for i, _ in picked]].copy()
+        result["Distance_km"] = [round(d, 2) for _, d in picked]
+        return result
+
+
+def build_listing_index(listings, gazetteer=None, cell_km=GRID_KM):
+    """Assign coordinates to listings and build the grid index over them."""
+    if gazetteer is None:
+        gazetteer = load_gazetteer()
+    return GridIndex(add_listing_coordinates(listings, gazetteer), cell_km)
+
+
+def open_listing_filter(as_of=None):
+    """Predicate for listings that still have quantity left and have not expired."""
+    as_of = str(as_of) if as_of is not None else None
+
+    def is_open(row):
+        remaining = row.get("Remaining_Quantity", row["Quantity"])
+        if pd.isna(remaining) or remaining <= 0:
+            return False
+        return as_of is None or str(row["Expiry_Date"]) >= as_of
+
+    return is_open
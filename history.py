@@ -0,0 +1,305 @@
+# Valid-time history of the listing and claim tables
+#
+# Every row version of providers_foodlisting and receivers_claims is kept in a
+# <table>_history table with Valid_From / Valid_To timestamps (UTC, Valid_To is
+# NULL for the current version). Triggers on the base tables close the current
+# version and open a new one on every insert, update and delete, so CRUD edits
+# and claim reservations are recorded as they happen. When the base tables are
+# reloaded from the CSVs the snapshot is reconciled against the open versions
+# in two set-based statements, so only rows that actually changed get a new
+# version.
+#
+# "As of" reads go through TEMP views named like the base tables: SQLite looks
+# in the temp schema first, so every existing dashboard query reads the past
+# without being rewritten.
+
+import hashlib
+import os
+
+import pandas as pd
+
+from triggers import install_triggers
+
+HISTORY_KEYS = {
+    "providers_foodlisting": "Food_ID",
+    "receivers_claims": "Claim_ID",
+}
+HISTORY_SUFFIX = "_history"
+SNAPSHOT_TABLE = "snapshot_loads"
+COMPACTION_TABLE = "history_compactions"
+
+NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def _columns(conn, table, schema="main"):
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _column_types(conn, table):
+    return {row[1]: row[2] for row in conn.execute(f"PRAGMA main.table_info({table})")}
+
+
+def _quote(column):
+    return f'"{column}"'
+
+
+def _same_row(columns, left, right):
+    # NULL-safe comparison of every column
+    return " AND ".join(f"{left}.{_quote(c)} IS {right}.{_quote(c)}" for c in columns)
+
+
+def _create_history_table(conn, table, columns):
+    """Create the history table with the base table's column types. Returns True if it was new."""
+    history = table + HISTORY_SUFFIX
+    key = HISTORY_KEYS[table]
+    types = _column_types(conn, table)
+    existing = _column_types(conn, history)
+    created = not existing
+    # Untyped key columns (older databases) cannot use the key index against the base table
+    retype = existing and existing.get(key) != types[key]
+    column_defs = ", ".join(f"{_quote(c)} {types[c]}" for c in columns)
+    if created:
+        conn.execute(f"CREATE TABLE {history} ({column_defs}, Valid_From TEXT NOT NULL, Valid_To TEXT)")
+    elif retype:
+        # Copy into a typed table in one transaction; the triggers point at the old table
+        kept = ", ".join(_quote(c) for c in existing if c in types or c in ("Valid_From", "Valid_To"))
+        conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        for event in ("insert", "update", "delete"):
+            conn.execute(f"DROP TRIGGER IF EXISTS trg_{table}_{event}")
+        conn.execute(f"ALTER TABLE {history} RENAME TO {history}_untyped")
+        conn.execute(f"CREATE TABLE {history} ({column_defs}, Valid_From TEXT NOT NULL, Valid_To TEXT)")
+        conn.execute(f"INSERT INTO {history} ({kept}) SELECT {kept} FROM {history}_untyped")
+        conn.execute(f"DROP TABLE {history}_untyped")
+        conn.execute("COMMIT")
+    else:
+        # The base table may have gained columns since the history table was made
+        for column in columns:
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {history} ADD COLUMN {_quote(column)} {types[column]}")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{history}_key ON {history} ({_quote(key)}, Valid_To)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{history}_valid ON {history} (Valid_From, Valid_To)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{history}_valid_to ON {history} (Valid_To)")
+    return created
+
+
+def _ensure_key_index(conn, table, key):
+    # The reconcile looks base rows up by key; reuse any index that starts with it
+    for index in conn.execute(f"PRAGMA main.index_list({table})").fetchall():
+        first = conn.execute(f"PRAGMA main.index_info({_quote(index[1])})").fetchone()
+        if first is not None and first[2] == key:
+            return
+    conn.execute(f"CREATE INDEX idx_{table}_{key.lower()} ON {table} ({_quote(key)})")
+
+
+def _reconcile(conn, table, columns):
+    """Version the current base table contents against the open history rows."""
+    history = table + HISTORY_SUFFIX
+    _ensure_key_index(conn, table, HISTORY_KEYS[table])
+    key = _quote(HISTORY_KEYS[table])
+    column_list = ", ".join(_quote(c) for c in columns)
+    b_columns = ", ".join(f"b.{_quote(c)}" for c in columns)
+    # Close open versions whose row is gone or changed
+    conn.execute(f"""
+        UPDATE {history} SET Valid_To = {NOW}
+        WHERE Valid_To IS NULL AND NOT EXISTS (
+            SELECT 1 FROM main.{table} b WHERE b.{key} IS {history}.{key} AND {_same_row(columns, 'b', history)}
+        )
+    """)
+    # Open versions for new or changed rows
+    conn.execute(f"""
+        INSERT INTO {history} ({column_list}, Valid_From)
+        SELECT {b_columns}, {NOW} FROM main.{table} b
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {history} h WHERE h.Valid_To IS NULL AND h.{key} IS b.{key} AND {_same_row(columns, 'h', 'b')}
+        )
+    """)
+
+
+def _create_triggers(conn, table, columns):
+    history = table + HISTORY_SUFFIX
+    key = _quote(HISTORY_KEYS[table])
+    column_list = ", ".join(_quote(c) for c in columns)
+    new_values = ", ".join(f"NEW.{_quote(c)}" for c in columns)
+    changed = " OR ".join(f"OLD.{_quote(c)} IS NOT NEW.{_quote(c)}" for c in columns)
+    close_old = f"UPDATE {history} SET Valid_To = {NOW} WHERE {key} IS OLD.{key} AND Valid_To IS NULL;"
+    open_new = f"INSERT INTO {history} ({column_list}, Valid_From) VALUES ({new_values}, {NOW});"
+    install_triggers(conn, {
+        f"trg_{table}_insert": f"AFTER INSERT ON {table} BEGIN {open_new} END",
+        f"trg_{table}_update": f"AFTER UPDATE ON {table} WHEN {changed} BEGIN {close_old} {open_new} END",
+        f"trg_{table}_delete": f"AFTER DELETE ON {table} BEGIN {close_old} END",
+    })
+
+
+def init_history(conn, reconcile=True):
+    """Create or extend the history tables, version the current data and (re)install triggers.
+
+    Safe to call on every run; it must run after any to_sql(if_exists='replace')
+    because dropping a base table also drops its triggers. Between reloads the
+    triggers already record every change, so callers can skip the reconcile
+    with `reconcile=False`; new history tables are always filled.
+    """
+    for table in HISTORY_KEYS:
+        columns = _columns(conn, table)
+        if not columns:
+            continue
+        created = _create_history_table(conn, table, columns)
+        if reconcile or created:
+            _reconcile(conn, table, columns)
+        _create_triggers(conn, table, columns)
+    conn.commit()
+
+
+def as_of_timestamp(value):
+    """Normalise a date/datetime/string to the history timestamp format."""
+    return pd.Timestamp(value).strftime(TIMESTAMP_FORMAT)[:23]
+
+
+def attach_as_of(conn, as_of):
+    """Shadow the base tables on this connection with their state at `as_of`.
+
+    Only affects `conn` (the views are TEMP), and leaves it read-only for those tables.
+    """
+    ts = as_of_timestamp(as_of)
+    for table in HISTORY_KEYS:
+        history = table + HISTORY_SUFFIX
+        columns = [c for c in _columns(conn, history) if c not in ("Valid_From", "Valid_To")]
+        if not columns:
+            continue
+        column_list = ", ".join(_quote(c) for c in columns)
+        conn.execute(f"DROP VIEW IF EXISTS temp.{table}")
+        conn.execute(f"""
+            CREATE TEMP VIEW {table} AS
+            SELECT {column_list} FROM main.{history}
+            WHERE Valid_From <= '{ts}' AND (Valid_To IS NULL OR Valid_To > '{ts}')
+        """)
+    return conn
+
+
+def history_range(conn):
+    """Earliest and latest Valid_From across the history tables, or (None, None)."""
+    parts = " UNION ALL ".join(
+        f"SELECT MIN(Valid_From) AS lo, MAX(Valid_From) AS hi FROM {table + HISTORY_SUFFIX}"
+        for table in HISTORY_KEYS if _columns(conn, table + HISTORY_SUFFIX)
+    )
+    if not parts:
+        return None, None
+    return conn.execute(f"SELECT MIN(lo), MAX(hi) FROM ({parts})").fetchone()
+
+
+def data_version(conn):
+    """Time of the latest recorded change to any history-tracked table.
+
+    Every insert, update and delete opens or closes a version, so this changes
+    whenever the data does; it is two index lookups per table.
+    """
+    parts = " UNION ALL ".join(
+        f"SELECT MAX(Valid_From) AS changed FROM main.{table + HISTORY_SUFFIX} "
+        f"UNION ALL SELECT MAX(Valid_To) FROM main.{table + HISTORY_SUFFIX}"
+        for table in HISTORY_KEYS if _columns(conn, table + HISTORY_SUFFIX)
+    )
+    if not parts:
+        return None
+    return conn.execute(f"SELECT MAX(changed) FROM ({parts})").fetchone()[0]
+
+
+def compact_history(conn, retain_after=None, thin_before=None, thinned_before=None):
+    """Bound history growth.
+
+    - Versions that ended before `retain_after` are deleted; "as of" queries
+      earlier than that point are no longer answerable.
+    - Closed versions that ended before `thin_before` are thinned to the last
+      version per key per day, so old history keeps daily resolution. The
+      kept version's Valid_From is stretched back to cover the dropped ones.
+      Days before the day of `thinned_before` (an earlier run's `thin_before`)
+      are already thinned and are skipped.
+
+    Returns the number of deleted history rows.
+    """
+    deleted = 0
+    for table in HISTORY_KEYS:
+        history = table + HISTORY_SUFFIX
+        if not _columns(conn, history):
+            continue
+        key = _quote(HISTORY_KEYS[table])
+        if retain_after is not None:
+            cursor = conn.execute(
+                f"DELETE FROM {history} WHERE Valid_To IS NOT NULL AND Valid_To < ?",
+                (as_of_timestamp(retain_after),),
+            )
+            deleted += cursor.rowcount
+        if thin_before is not None:
+            cutoff = as_of_timestamp(thin_before)
+            since = as_of_timestamp(pd.Timestamp(thinned_before).normalize()) if thinned_before is not None else ""
+            # Only days with more than one version of a key; thinned days are left alone
+            conn.execute(f"""
+                CREATE TEMP TABLE thin AS
+                SELECT rid, first_from, rn FROM (
+                    SELECT rowid AS rid,
+                           MIN(Valid_From) OVER (PARTITION BY {key}, date(Valid_To)) AS first_from,
+                           ROW_NUMBER() OVER (PARTITION BY {key}, date(Valid_To) ORDER BY Valid_To DESC) AS rn,
+                           COUNT(*) OVER (PARTITION BY {key}, date(Valid_To)) AS versions
+                    FROM {history}
+                    WHERE Valid_To >= ? AND Valid_To < ?
+                ) WHERE versions > 1
+            """, (since, cutoff))
+            conn.execute(f"""
+                UPDATE {history} SET Valid_From = t.first_from
+                FROM temp.thin t WHERE t.rid = {history}.rowid AND t.rn = 1
+            """)
+            cursor = conn.execute(f"DELETE FROM {history} WHERE rowid IN (SELECT rid FROM temp.thin WHERE rn > 1)")
+            deleted += cursor.rowcount
+            conn.execute("DROP TABLE temp.thin")
+    conn.commit()
+    return deleted
+
+
+def compact_history_if_due(conn, retain_after=None, thin_before=None, every=pd.Timedelta(days=1), force=False):
+    """compact_history at most once per `every` (or when forced, e.g. after a reload).
+
+    The last run is recorded in the history_compactions table. Returns the
+    number of deleted rows, or None when compaction was not due.
+    """
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {COMPACTION_TABLE} (Compacted_At TEXT, Thinned_Before TEXT)")
+    last = conn.execute(f"SELECT Compacted_At, Thinned_Before FROM {COMPACTION_TABLE}").fetchone()
+    now = pd.Timestamp.now(tz="UTC").tz_localize(None)
+    if not force and last is not None and pd.Timestamp(last[0]) > now - every:
+        return None
+    # A forced run (after a reload) rechecks every day
+    thinned_before = last[1] if last is not None and not force else None
+    deleted = compact_history(conn, retain_after, thin_before, thinned_before)
+    conn.execute(f"DELETE FROM {COMPACTION_TABLE}")
+    conn.execute(
+        f"INSERT INTO {COMPACTION_TABLE} VALUES ({NOW}, ?)",
+        (as_of_timestamp(thin_before) if thin_before is not None else None,),
+    )
+    conn.commit()
+    return deleted
+
+
+# --- Reload detection ---
+
+def source_fingerprint(paths):
+    """Fingerprint of the source files from their names, sizes and modification times."""
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        stat = os.stat(path)
+        digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns};".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def snapshot_loaded(conn, fingerprint):
+    """True if this exact set of source files was already loaded into the database."""
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {SNAPSHOT_TABLE} (Fingerprint TEXT, Loaded_At TEXT)")
+    row = conn.execute(
+        f"SELECT Fingerprint FROM {SNAPSHOT_TABLE} ORDER BY rowid DESC LIMIT 1"
+    ).fetchone()
+    tables_present = all(_columns(conn, table) for table in HISTORY_KEYS)
+    return tables_present and row is not None and row[0] == fingerprint
+
+
+def record_snapshot(conn, fingerprint):
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {SNAPSHOT_TABLE} (Fingerprint TEXT, Loaded_At TEXT)")
+    conn.execute(f"INSERT INTO {SNAPSHOT_TABLE} VALUES (?, {NOW})", (fingerprint,))
+    conn.commit()
@@ -0,0 +1,192 @@
+# Top-N leaderboards kept up to date on every write
+#
+# Rankings are stored pre-aggregated in one rollup table, one row per
+# (Board, City, Entity) with its Score, and an index on (Board, City, Score).
+# Reading a top-K board is an index range scan of K rows instead of grouping
+# and sorting the claim table. City is '*' for the overall board and the
+# provider/receiver city for the per-city variants ('' when the city is unknown).
+#
+# Boards are defined as "contributions": every claim (joined to its listing)
+# or listing adds to one entry per board. Triggers on both base tables
+# subtract the contributions of the OLD row and add those of the NEW row, so
+# the rollup stays exact across claims, status changes, deletes and listing
+# edits. rebuild_leaderboards recomputes everything from scratch.
+
+from triggers import install_triggers
+
+LEADERBOARD_TABLE = "leaderboards"
+ALL_CITIES = "*"
+
+# Board -> (entity, label, city, score, condition) over a claim `c` joined to its listing `l`
+CLAIM_BOARDS = {
+    "provider_claims": ("l.Provider_ID", "l.Name", "l.City", "1", "1"),
+    "provider_completed_claims": ("l.Provider_ID", "l.Name", "l.City", "1", "c.Status = 'Completed'"),
+    "provider_quantity_donated": ("l.Provider_ID", "l.Name", "l.City", "l.Quantity", "c.Status = 'Completed'"),
+    "receiver_claims": ("c.Receiver_ID", "c.Name", "c.City", "1", "1"),
+    "food_claims": ("l.Food_ID", "l.Food_Name", "l.City", "1", "1"),
+}
+# Board -> (entity, label, city, score) over a listing `l`
+LISTING_BOARDS = {
+    "provider_listings": ("l.Name", "l.Name", "l.City", "1"),
+    "provider_listed_quantity": ("l.Name", "l.Name", "l.City", "l.Quantity"),
+}
+
+CLAIM_COLUMNS = ("Receiver_ID", "Name", "City", "Food_ID", "Status")
+LISTING_COLUMNS = ("Provider_ID", "Name", "City", "Food_ID", "Food_Name", "Quantity")
+
+
+def _row(alias, columns):
+    # OLD/NEW row of a trigger as a one-row subquery
+    return "(SELECT " + ", ".join(f"{alias}.{c} AS {c}" for c in columns) + ")"
+
+
+def _contributions(claims, listings, sign):
+    """SELECT of (Board, City, Entity, Label, Score) rows, overall and per city."""
+    parts = []
+    for board, (entity, label, city, score, condition) in CLAIM_BOARDS.items():
+        for board_city in (f"'{ALL_CITIES}'", city):
+            parts.append(
+                f"SELECT '{board}' AS Board, COALESCE({board_city}, '') AS City, COALESCE(CAST({entity} AS TEXT), '') AS Entity, "
+                f"{label} AS Label, COALESCE({sign} * {score}, 0) AS Score "
+                f"FROM {claims} c JOIN {listings} l ON l.Food_ID = c.Food_ID WHERE {condition}"
+            )
+    return " UNION ALL ".join(parts)
+
+
+def _listing_contributions(listings, sign):
+    parts = []
+    for board, (entity, label, city, score) in LISTING_BOARDS.items():
+        for board_city in (f"'{ALL_CITIES}'", city):
+            parts.append(
+                f"SELECT '{board}' AS Board, COALESCE({board_city}, '') AS City, COALESCE(CAST({entity} AS TEXT), '') AS Entity, "
+                f"{label} AS Label, COALESCE({sign} * {score}, 0) AS Score FROM {listings} l"
+            )
+    return " UNION ALL ".join(parts)
+
+
+def _apply(contributions):
+    return (
+        f"INSERT INTO {LEADERBOARD_TABLE} (Board, City, Entity, Label, Score) "
+        f"SELECT * FROM ({contributions}) WHERE true "
+        f"ON CONFLICT (Board, City, Entity) DO UPDATE SET Score = Score + excluded.Score, Label = excluded.Label;"
+    )
+
+
+def _create_table(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {LEADERBOARD_TABLE} (
+            Board TEXT NOT NULL,
+            City TEXT NOT NULL,
+            Entity TEXT NOT NULL,
+            Label TEXT,
+            Score INTEGER NOT NULL,
+            PRIMARY KEY (Board, City, Entity)
+        )
+    """)
+    conn.execute(
+        f"CREATE INDEX IF NOT EXISTS idx_{LEADERBOARD_TABLE}_rank ON {LEADERBOARD_TABLE} (Board, City, Score DESC, Entity)"
+    )
+    # Listing triggers look up the claims of one Food_ID
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_claims_food_id ON receivers_claims (Food_ID)")
+
+
+def _create_triggers(conn):
+    old_claim, new_claim = _row("OLD", CLAIM_COLUMNS), _row("NEW", CLAIM_COLUMNS)
+    old_listing, new_listing = _row("OLD", LISTING_COLUMNS), _row("NEW", LISTING_COLUMNS)
+    claim_changed = " OR ".join(f"OLD.{c} IS NOT NEW.{c}" for c in CLAIM_COLUMNS)
+    listing_changed = " OR ".join(f"OLD.{c} IS NOT NEW.{c}" for c in LISTING_COLUMNS)
+    triggers = {
+        "trg_leaderboards_claim_insert": f"AFTER INSERT ON receivers_claims BEGIN "
+        f"{_apply(_contributions(new_claim, 'providers_foodlisting', 1))} END",
+        "trg_leaderboards_claim_update": f"AFTER UPDATE ON receivers_claims WHEN {claim_changed} BEGIN "
+        f"{_apply(_contributions(old_claim, 'providers_foodlisting', -1))} "
+        f"{_apply(_contributions(new_claim, 'providers_foodlisting', 1))} END",
+        "trg_leaderboards_claim_delete": f"AFTER DELETE ON receivers_claims BEGIN "
+        f"{_apply(_contributions(old_claim, 'providers_foodlisting', -1))} END",
+        "trg_leaderboards_listing_insert": f"AFTER INSERT ON providers_foodlisting BEGIN "
+        f"{_apply(_contributions('receivers_claims', new_listing, 1))} "
+        f"{_apply(_listing_contributions(new_listing, 1))} END",
+        "trg_leaderboards_listing_update": f"AFTER UPDATE ON providers_foodlisting WHEN {listing_changed} BEGIN "
+        f"{_apply(_contributions('receivers_claims', old_listing, -1))} "
+        f"{_apply(_listing_contributions(old_listing, -1))} "
+        f"{_apply(_contributions('receivers_claims', new_listing, 1))} "
+        f"{_apply(_listing_contributions(new_listing, 1))} END",
+        "trg_leaderboards_listing_delete": f"AFTER DELETE ON providers_foodlisting BEGIN "
+        f"{_apply(_contributions('receivers_claims', old_listing, -1))} "
+        f"{_apply(_listing_contributions(old_listing, -1))} END",
+    }
+    install_triggers(conn, triggers)
+
+
+def rebuild_leaderboards(conn):
+    """Recompute every board from the base tables."""
+    conn.execute(f"DELETE FROM {LEADERBOARD_TABLE}")
+    conn.execute(f"""
+        INSERT INTO {LEADERBOARD_TABLE} (Board, City, Entity, Label, Score)
+        SELECT Board, City, Entity, MAX(Label), SUM(Score)
+        FROM ({_contributions('receivers_claims', 'providers_foodlisting', 1)}
+              UNION ALL {_listing_contributions('providers_foodlisting', 1)})
+        GROUP BY Board, City, Entity
+    """)
+
+
+def init_leaderboards(conn, rebuild=False):
+    """Create the rollup table, fill it when new or asked to, and install the triggers.
+
+    Must run after the base tables are (re)loaded: replacing a table drops its triggers.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (LEADERBOARD_TABLE,)
+    ).fetchone()
+    _create_table(conn)
+    if rebuild or not exists:
+        rebuild_leaderboards(conn)
+    conn.commit()
+    _create_triggers(conn)
+
+
+def top_k(conn, board, k=10, city=ALL_CITIES):
+    """The top `k` entries of a board as (Entity, Label, Score) rows, best first."""
+    return conn.execute(
+        f"""
+        SELECT Entity, Label, Score FROM {LEADERBOARD_TABLE}
+        WHERE Board = ? AND City = ? AND Score > 0
+        ORDER BY Score DESC, Entity
+        LIMIT ?
+        """,
+        (board, city, k),
+    ).fetchall()
+
+
+def scores(conn, board, entities, city=ALL_CITIES):
+    """Scores of specific entities on a board, as {Entity: Score}."""
+    entities = [str(e) for e in entities]
+    if not entities:
+        return {}
+    placeholders = ", ".join("?" * len(entities))
+    rows = conn.execute(
+        f"SELECT Entity, Score FROM {LEADERBOARD_TABLE} WHERE Board = ? AND City = ? AND Entity IN ({placeholders})",
+        [board, city, *entities],
+    ).fetchall()
+    return dict(rows)
+
+
+def compute_top_k(conn, board, k=10, city=ALL_CITIES):
+    """Same result as top_k, computed from the base tables instead of the rollup.
+
+    Used for "as of" reads, where the base table names point at past versions
+    but the rollup only holds the current rankings.
+    """
+    return conn.execute(
+        f"""
+        SELECT Entity, MAX(Label), SUM(Score) AS Total
+        FROM ({_contributions('receivers_claims', 'providers_foodlisting', 1)}
+              UNION ALL {_listing_contributions('providers_foodlisting', 1)})
+        WHERE Board = ? AND City = ?
+        GROUP BY Entity
+        HAVING Total > 0
+        ORDER BY Total DESC, Entity
+        LIMIT ?
+        """,
+        (board, city, k),
+    ).fetchall()
@@ -0,0 +1,223 @@
+# Load test for the Streamlit dashboard
+#
+# Simulates N coordinators using the dashboard at the same time. Every session
+# runs in its own process with Streamlit's headless testing API (AppTest), so
+# each action is a real script rerun against the same SQLite file: page loads,
+# sidebar filter changes, and Add / Update / Delete / Claim form submissions,
+# picked at random with the weights in ACTION_MIX.
+#
+# The test runs on a copy of the project folder (script, modules, CSVs and
+# database), so the real database is never written to. It reports latency
+# percentiles per action and overall, throughput, and how many reruns failed
+# with SQLite busy/lock errors.
+#
+# Usage: python load_test.py --sessions 8 --actions 25
+
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+APP_SCRIPT = ('Food_Management_analysis.py')
+# Relative weight of each simulated action
+ACTION_MIX = {
+    "page_load": 4,
+    "filter_change": 4,
+    "add": 1,
+    "update": 1,
+    "delete": 1,
+    "claim": 1,
+}
+# Seconds a single rerun may take before AppTest gives up
+RERUN_TIMEOUT = 300
+
+LOCK_ERRORS = ("database is locked", "database is busy", "database table is locked")
+
+
+def copy_app(src_dir, dst_dir):
+    """Copy the project next to its database; copy2 keeps mtimes so the CSVs are not reloaded."""
+    shutil.copytree(
+        src_dir, dst_dir, dirs_exist_ok=True,
+        ignore=shutil.ignore_patterns(".git", "__pycache__", "*.db-wal", "*.db-shm"),
+    )
+
+
+def _app(script):
+    from streamlit.testing.v1 import AppTest
+    return AppTest.from_file(script, default_timeout=RERUN_TIMEOUT)
+
+
+def _widget(widgets, label, form_id=None):
+    for widget in widgets:
+        if widget.label == label and (form_id is None or widget.form_id == form_id):
+            return widget
+    return None
+
+
+def _act(at, script, action, rng, session_id, step):
+    """Set up the widgets for one action and rerun the script."""
+    if action == "page_load":
+        # A fresh browser session: new AppTest, first run
+        at = _app(script)
+    elif action == "filter_change":
+        city = _widget(at.sidebar.selectbox, "City")
+        if city is not None:
+            city.select(rng.choice(city.options))
+    elif action == "add":
+        _widget(at.text_input, "Name", "add_provider").input(f"Load Test {session_id}-{step}")
+        _widget(at.text_input, "City", "add_provider").input("Load Test City")
+        _widget(at.button, "Add").click()
+    elif action == "update":
+        _widget(at.button, "Update").click()
+    elif action == "delete":
+        select = _widget(at.selectbox, "Select Provider to Delete")
+        if select is not None and select.options:
+            select.select(select.options[-1])
+        _widget(at.button, "Delete").click()
+    elif action == "claim":
+        select = _widget(at.selectbox, "Select Food to Claim")
+        if select is not None and select.options:
+            select.select(rng.choice(select.options))
+        _widget(at.button, "Claim").click()
+    at.run()
+    return at
+
+
+def run_session(app_dir, session_id, n_actions, mix, seed):
+    """One simulated user; runs in a worker process. Returns a list of result dicts."""
+    os.chdir(app_dir)
+    # Test the copied script and modules, not the ones next to this file
+    # (AppTest resolves relative paths against the calling file)
+    sys.path.insert(0, app_dir)
+    script = os.path.join(app_dir, APP_SCRIPT)
+    rng = random.Random(seed + session_id)
+    actions, weights = zip(*mix.items())
+    results = []
+    at = None
+    for step in range(n_actions):
+        action = "page_load" if at is None else rng.choices(actions, weights)[0]
+        start = time.perf_counter()
+        error = None
+        try:
+            # The script prints its analysis on every rerun
+            with contextlib.redirect_stdout(io.StringIO()):
+                at = _act(at if at is not None else _app(script), script, action, rng, session_id, step)
+            if at.exception:
+                failure = at.exception[0]
+                # The message carries the exception text; the stack trace's last line is only a frame
+                error = failure.message
+                # The page stopped half way; the user would reload it
+                at = None
+        except Exception as exc:  # a widget missing after a failed rerun, a timeout, ...
+            error = f"{type(exc).__name__}: {exc}"
+            at = None
+        results.append({
+            "Session": session_id,
+            "Action": action,
+            "Seconds": time.perf_counter() - start,
+            "Error": error,
+            "Lock_Error": error is not None and any(text in error for text in LOCK_ERRORS),
+        })
+    return results
+
+
+def summarize(results, wall_seconds):
+    """Latency percentiles, throughput and error counts per action and overall."""
+    df = pd.DataFrame(results)
+
+    def stats(group):
+        ms = group["Seconds"].to_numpy() * 1000
+        return pd.Series({
+            "count": len(group),
+            "p50_ms": np.percentile(ms, 50),
+            "p95_ms": np.percentile(ms, 95),
+            "p99_ms": np.percentile(ms, 99),
+            "max_ms": ms.max(),
+            "errors": int(group["Error"].notna().sum()),
+            "lock_errors": int(group["Lock_Error"].sum()),
+        })
+
+    table = df.groupby("Action").apply(stats, include_groups=False)
+    table.loc["all"] = stats(df)
+    table[["count", "errors", "lock_errors"]] = table[["count", "errors", "lock_errors"]].astype(int)
+    summary = {
+        "sessions": df["Session"].nunique(),
+        "reruns": len(df),
+        "wall_seconds": round(wall_seconds, 2),
+        "throughput_per_s": round(len(df) / wall_seconds, 2) if wall_seconds else 0.0,
+        "lock_errors": int(df["Lock_Error"].sum()),
+        "other_errors": int((df["Error"].notna() & ~df["Lock_Error"]).sum()),
+    }
+    return summary, table.round(1)
+
+
+def load_test(app_dir=".", sessions=8, actions=25, mix=None, seed=0, keep_dir=False):
+    """Run `sessions` concurrent sessions of `actions` reruns each on a copy of the app.
+
+    Returns (summary dict, per-action table, raw results DataFrame).
+    """
+    mix = mix or ACTION_MIX
+    work_dir = tempfile.mkdtemp(prefix="food_load_test_")
+    try:
+        copy_app(os.path.abspath(app_dir), work_dir)
+        # Sessions only run in fresh worker processes: AppTest swaps out __main__ while it runs
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=sessions, mp_context=context, max_tasks_per_child=1) as pool:
+            # One run first so the database exists and the sessions do not all build it at once
+            pool.submit(run_session, work_dir, -1, 1, mix, seed).result()
+            start = time.perf_counter()
+            futures = [pool.submit(run_session, work_dir, i, actions, mix, seed) for i in range(sessions)]
+            results = [row for future in futures for row in future.result()]
+        wall = time.perf_counter() - start
+    finally:
+        if keep_dir:
+            print("Load test copy kept in", work_dir)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    summary, table = summarize(results, wall)
+    return summary, table, pd.DataFrame(results)
+
+
+def _parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, weight = part.split("=")
+        if name not in ACTION_MIX:
+            raise argparse.ArgumentTypeError(f"unknown action {name!r}, expected one of {', '.join(ACTION_MIX)}")
+        mix[name] = float(weight)
+    return mix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the dashboard with concurrent headless sessions.")
+    parser.add_argument("--app-dir", default=".")
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--actions", type=int, default=25, help="reruns per session")
+    parser.add_argument("--mix", type=_parse_mix, default=None,
+                        help="action weights, e.g. page_load=4,filter_change=4,add=1,update=1,delete=1,claim=1")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="keep the copied app and database")
+    parser.add_argument("--csv", default=None, help="write every rerun's timing to this CSV")
+    args = parser.parse_args()
+
+    # Through the module, so the worker processes can find run_session by name
+    import load_test as module
+    summary, table, raw = module.load_test(args.app_dir, args.sessions, args.actions, args.mix, args.seed, args.keep)
+    print(summary)
+    print(table.to_string())
+    errors = raw[raw["Error"].notna()]
+    if not errors.empty:
+        print("\nMost common errors:")
+        print(errors["Error"].str.slice(0, 120).value_counts().head(10).to_string())
+    if args.csv:
+        raw.to_csv(args.csv, index=False)
@@ -0,0 +1,208 @@
+# Fuzzy search over provider names, food names, addresses and receiver names
+#
+# Every searchable text is broken into word trigrams the same way PostgreSQL's
+# pg_trgm does it (each word padded with two leading spaces and one trailing
+# space), so a short prefix such as "gon" still matches "Gonzales" and a typo
+# such as "Gonzalez" shares most of its trigrams with the right name.
+#
+# The index keeps one numpy array of document ids per trigram. A query looks up
+# the postings for its trigrams, counts hits per document with np.bincount and
+# ranks by trigram similarity, so no Python loop ever touches the full corpus.
+#
+# The dashboard caches the built index keyed by a counter in
+# search_index_version. Triggers bump it only when an indexed column changes
+# (a listing's Name, Food_Name, Address or Food_ID, a receiver's Name, a new or
+# removed listing or receiver), so claims and quantity edits keep the index.
+
+import math
+import re
+
+import numpy as np
+import pandas as pd
+
+from triggers import install_triggers
+
+# Minimum trigram similarity for a document to be returned
+MIN_SIMILARITY = 0.2
+# Extra score for documents with a word that starts with the query
+PREFIX_BONUS = 0.5
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+SEARCH_VERSION_TABLE = "search_index_version"
+LISTING_SEARCH_COLUMNS = ("Name", "Food_Name", "Address", "Food_ID")
+CLAIM_SEARCH_COLUMNS = ("Receiver_ID", "Name")
+
+
+def words(text):
+    """Lowercase alphanumeric words of a text."""
+    return _WORD_RE.findall(str(text).lower())
+
+
+def trigrams(text):
+    """Set of pg_trgm style trigrams of a text."""
+    grams = set()
+    for word in words(text):
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+def query_trigrams(text):
+    """Trigrams used to look a query up.
+
+    The single letter "  x" gram is left out of words that already have a " xy"
+    gram, and the last word loses its closing "yz " gram so a half typed word
+    still matches as a prefix. Both grams are shared by a large part of any
+    corpus, so dropping them also keeps the posting lists short.
+    """
+    query_words = words(text)
+    grams = set()
+    for n, word in enumerate(query_words):
+        padded = f"  {word} "
+        start = 1 if len(word) >= 2 else 0
+        end = len(padded) - 3 if n == len(query_words) - 1 else len(padded) - 2
+        for i in range(start, end):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+class TrigramIndex:
+    """Inverted trigram index over (kind, key, text) documents."""
+
+    def __init__(self, kinds, keys, texts):
+        # Kinds are stored as small integer codes so filtering by kind stays vectorized
+        self.kind_names, kind_codes = np.unique(np.asarray(kinds, dtype=str), return_inverse=True)
+        self.kind_codes = kind_codes.astype(np.int8)
+        self.keys = np.asarray(keys, dtype=object)
+        self.texts = np.asarray(texts, dtype=object)
+        postings = {}
+        sizes = np.zeros(len(self.texts), dtype=np.int32)
+        for doc_id, text in enumerate(self.texts):
+            grams = trigrams(text)
+            sizes[doc_id] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(doc_id)
+        self.sizes = sizes
+        self.postings = {gram: np.asarray(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    def search(self, query, kind=None, limit=20, min_similarity=MIN_SIMILARITY):
+        """Ranked matches for `query` as a DataFrame of Kind, Key, Text, Score."""
+        query_grams = query_trigrams(query)
+        empty = pd.DataFrame({"Kind": [], "Key": [], "Text": [], "Score": []})
+        hits = [self.postings[g] for g in query_grams if g in self.postings]
+        if not hits:
+            return empty
+
+        shared = np.bincount(np.concatenate(hits), minlength=len(self.texts))
+        # The score never exceeds the query coverage, so documents sharing too few
+        # trigrams can be dropped before any scoring
+        min_shared = max(1, math.ceil(min_similarity * len(query_grams)))
+        candidates = np.flatnonzero(shared >= min_shared)
+        if kind is not None:
+            code = np.searchsorted(self.kind_names, kind)
+            if code >= len(self.kind_names) or self.kind_names[code] != kind:
+                return empty
+            candidates = candidates[self.kind_codes[candidates] == code]
+        if len(candidates) == 0:
+            return empty
+
+        # Word similarity: how much of the query is covered, damped by document length
+        common = shared[candidates].astype(np.float64)
+        coverage = common / len(query_grams)
+        jaccard = common / (len(query_grams) + self.sizes[candidates] - common)
+        scores = 0.7 * coverage + 0.3 * jaccard
+        keep = scores >= min_similarity
+        candidates, scores = candidates[keep], scores[keep]
+        if len(candidates) == 0:
+            return empty
+
+        # Prefix bonus only needs checking on the leading candidates
+        shortlist = min(len(candidates), limit * 5)
+        top = np.argpartition(-scores, shortlist - 1)[:shortlist]
+        candidates, scores = candidates[top], scores[top].copy()
+        query_words = words(query)
+        if query_words:
+            prefix = query_words[-1]
+            for i, doc_id in enumerate(candidates):
+                if any(w.startswith(prefix) for w in words(self.texts[doc_id])):
+                    scores[i] += PREFIX_BONUS
+
+        order = np.argsort(-scores, kind="stable")[:limit]
+        picked = candidates[order]
+        return pd.DataFrame({
+            "Kind": self.kind_names[self.kind_codes[picked]],
+            "Key": self.keys[picked],
+            "Text": self.texts[picked],
+            "Score": np.round(scores[order], 3),
+        })
+
+    def search_keys(self, query, kind, limit=20):
+        """Keys of the best matches of one kind, in rank order and without repeats."""
+        keys = self.search(query, kind=kind, limit=limit * 3)["Key"].tolist()
+        return list(dict.fromkeys(keys))[:limit]
+
+
+def build_search_index(listings, claims):
+    """Index provider Name, Food_Name, Address and receiver Name.
+
+    Provider names and food names repeat across many listings, so each distinct
+    value is indexed once and keyed by the value itself. Addresses are keyed by
+    Food_ID and receivers by Receiver_ID.
+    """
+    providers = listings["Name"].dropna().unique().tolist()
+    foods = listings["Food_Name"].dropna().unique().tolist()
+    addresses = listings.dropna(subset=["Address"])
+    receivers = claims.drop_duplicates("Receiver_ID")
+    kinds = (
+        ["provider"] * len(providers)
+        + ["food"] * len(foods)
+        + ["address"] * len(addresses)
+        + ["receiver"] * len(receivers)
+    )
+    keys = providers + foods + addresses["Food_ID"].tolist() + receivers["Receiver_ID"].tolist()
+    texts = (
+        providers
+        + foods
+        + addresses["Address"].tolist()
+        + receivers["Name"].fillna("").tolist()
+    )
+    return TrigramIndex(kinds, keys, texts)
+
+
+def init_search_version(conn):
+    """Create the search index version counter and the triggers that bump it.
+
+    Must run after the base tables are (re)loaded: replacing a table drops its
+    triggers, and reinstalling them bumps the version since anything may have changed.
+    """
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {SEARCH_VERSION_TABLE} (Version INTEGER NOT NULL)")
+    conn.execute(
+        f"INSERT INTO {SEARCH_VERSION_TABLE} (Version) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM {SEARCH_VERSION_TABLE})"
+    )
+    # The claim insert trigger checks whether the receiver is new
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_claims_receiver_id ON receivers_claims (Receiver_ID)")
+    conn.commit()
+    bump = f"UPDATE {SEARCH_VERSION_TABLE} SET Version = Version + 1;"
+    listing_changed = " OR ".join(f"OLD.{c} IS NOT NEW.{c}" for c in LISTING_SEARCH_COLUMNS)
+    claim_changed = " OR ".join(f"OLD.{c} IS NOT NEW.{c}" for c in CLAIM_SEARCH_COLUMNS)
+    new_receiver = (
+        "NOT EXISTS (SELECT 1 FROM receivers_claims WHERE Receiver_ID = NEW.Receiver_ID AND rowid <> NEW.rowid)"
+    )
+    installed = install_triggers(conn, {
+        "trg_search_listing_insert": f"AFTER INSERT ON providers_foodlisting BEGIN {bump} END",
+        "trg_search_listing_update": f"AFTER UPDATE ON providers_foodlisting WHEN {listing_changed} BEGIN {bump} END",
+        "trg_search_listing_delete": f"AFTER DELETE ON providers_foodlisting BEGIN {bump} END",
+        "trg_search_claim_insert": f"AFTER INSERT ON receivers_claims WHEN {new_receiver} BEGIN {bump} END",
+        "trg_search_claim_update": f"AFTER UPDATE ON receivers_claims WHEN {claim_changed} BEGIN {bump} END",
+        "trg_search_claim_delete": f"AFTER DELETE ON receivers_claims BEGIN {bump} END",
+    })
+    if installed:
+        conn.execute(bump)
+        conn.commit()
+
+
+def search_version(conn):
+    """Current value of the search index version counter."""
+    return conn.execute(f"SELECT Version FROM {SEARCH_VERSION_TABLE}").fetchone()[0]
@@ -0,0 +1,244 @@
+# Parallel ingestion and analysis for per-region shard files
+#
+# Feeds arrive as many CSV files, e.g. feeds/providers_foodlisting_<region>.csv
+# and feeds/receivers_claims_<region>.csv. Parsing and checking a shard is CPU
+# work and runs in a process pool; SQLite only allows one writer at a time, so
+# every parsed shard is handed back to the parent process, which is the single
+# writer and appends it in bulk while the pool keeps parsing the next shards.
+# The workers also run the per-row validation rules (type coercion, Status,
+# expiry, Type/Location mismatches) and shape their rejects for the quarantine
+# table. Only the ID rules, which need every shard seen so far, run in the
+# writer: listing shards first, so claims can be checked against the accepted
+# Food_IDs.
+#
+# Analysis questions can also run straight off the shards, map-reduce style:
+# each worker reduces its shard to a small partial aggregate (counts, sums or
+# distinct key pairs) and the parent merges the partials.
+
+import argparse
+import functools
+import glob
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from validation import (
+    QUARANTINE_COLUMNS, Validator, check_claim_rows, check_listing_rows, quarantine_records, write_quarantine,
+)
+
+DB_PATH = ('food_waste.db')
+FEEDS_DIR = ('feeds')
+
+LISTING_COLUMNS = [
+    "Provider_ID", "Name", "Type", "Address", "City", "Contact", "Food_ID", "Food_Name",
+    "Quantity", "Expiry_Date", "Provider_Type", "Location", "Food_Type", "Meal_Type",
+]
+CLAIM_COLUMNS = [
+    "Receiver_ID", "Name", "Type", "City", "Contact", "Claim_ID", "Food_ID", "Status",
+    "Timestamp_formatted",
+]
+TABLES = {
+    "providers_foodlisting": LISTING_COLUMNS,
+    "receivers_claims": CLAIM_COLUMNS,
+}
+
+
+def discover_shards(feeds_dir=FEEDS_DIR):
+    """Shard files per table, found by the table name prefix of the file name."""
+    return {
+        table: sorted(glob.glob(os.path.join(feeds_dir, f"{table}*.csv")))
+        for table in TABLES
+    }
+
+
+def parse_shard(path, table, expiry_as_of=None):
+    """Read one shard, check it has the table's columns and apply the per-row rules.
+
+    Runs in a worker process. Returns (path, table, clean DataFrame or None,
+    quarantine records or None, error).
+    """
+    try:
+        df = pd.read_csv(path)
+    except (OSError, ValueError) as exc:
+        return path, table, None, None, f"could not parse: {exc}"
+    df.columns = df.columns.str.strip()
+    missing = [c for c in TABLES[table] if c not in df.columns]
+    if missing:
+        return path, table, None, None, f"missing columns: {', '.join(missing)}"
+    df = df[TABLES[table]]
+    if table == "providers_foodlisting":
+        clean, bad = check_listing_rows(df, expiry_as_of)
+    else:
+        clean, bad = check_claim_rows(df)
+    return path, table, clean, _shard_quarantine(path, table, bad), None
+
+
+def _shard_quarantine(path, table, bad):
+    records = quarantine_records(table, bad)
+    records["Source_Table"] = f"{table}:{os.path.basename(path)}"
+    return records
+
+
+def _prepare_tables(conn, tables):
+    # Same effect as to_sql(if_exists='replace'), done once before the shards stream in
+    for table in tables:
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+def ingest_shards(feeds_dir=FEEDS_DIR, db_path=DB_PATH, workers=None, expiry_as_of=None):
+    """Parse every shard in a process pool and bulk insert through one writer.
+
+    Returns a summary dict with rows written and quarantined per table, rejected
+    shards and timing.
+    """
+    shards = discover_shards(feeds_dir)
+    summary = {"rows": {table: 0 for table in TABLES}, "quarantined": 0, "rejected": [], "shards": 0}
+    # The writer only keeps the accepted IDs; the expiry rule runs in the workers
+    validator = Validator()
+    checks = {
+        "providers_foodlisting": validator.check_listing_ids,
+        "receivers_claims": validator.check_claim_ids,
+    }
+    start = time.perf_counter()
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    _prepare_tables(conn, [table for table, paths in shards.items() if paths])
+    write_quarantine(conn, pd.DataFrame(columns=QUARANTINE_COLUMNS))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            table: [pool.submit(parse_shard, path, table, expiry_as_of) for path in paths]
+            for table, paths in shards.items()
+        }
+        # Listing shards are written before any claim shard
+        for table in TABLES:
+            for future in as_completed(futures[table]):
+                path, table, df, records, error = future.result()
+                summary["shards"] += 1
+                if error:
+                    summary["rejected"].append((path, error))
+                    continue
+                clean, bad = checks[table](df)
+                clean.to_sql(table, conn, if_exists="append", index=False, chunksize=50_000)
+                # Rows the workers rejected, then the few that failed the ID rules here
+                rejects = [r for r in (records, _shard_quarantine(path, table, bad)) if not r.empty]
+                if rejects:
+                    write_quarantine(conn, pd.concat(rejects, ignore_index=True), replace=False)
+                conn.commit()
+                summary["rows"][table] += len(clean)
+                summary["quarantined"] += sum(len(r) for r in rejects)
+    conn.close()
+
+    summary["seconds"] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+# --- Map-reduce analysis over shards ---
+
+def partial_count(path, by, value=None):
+    """Rows (or the sum of `value`) per group within one shard."""
+    columns = list(by) + ([value] if value else [])
+    df = pd.read_csv(path, usecols=columns)
+    grouped = df.groupby(list(by))
+    partial = grouped[value].sum() if value else grouped.size()
+    return partial.rename(value or "count").reset_index()
+
+
+def merge_count(partials, by, value=None):
+    name = value or "count"
+    merged = pd.concat(partials, ignore_index=True)
+    return merged.groupby(list(by), as_index=False)[name].sum().sort_values(name, ascending=False)
+
+
+def partial_distinct(path, by, column):
+    """Distinct (group, column) pairs within one shard."""
+    df = pd.read_csv(path, usecols=list(by) + [column])
+    return df.drop_duplicates()
+
+
+def merge_distinct(partials, by, column):
+    merged = pd.concat(partials, ignore_index=True).drop_duplicates()
+    return merged.groupby(list(by), as_index=False)[column].nunique()
+
+
+def map_reduce(paths, map_fn, reduce_fn, workers=None):
+    """Run map_fn(path) on every shard in a process pool and reduce the partials."""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        partials = list(pool.map(map_fn, paths))
+    return reduce_fn(partials)
+
+
+def sharded_count(paths, by, value=None, workers=None):
+    """Group counts (or sums of `value`) across all shards, largest first."""
+    by = tuple(by)
+    return map_reduce(
+        paths,
+        functools.partial(partial_count, by=by, value=value),
+        functools.partial(merge_count, by=by, value=value),
+        workers,
+    )
+
+
+def sharded_distinct(paths, by, column, workers=None):
+    """Distinct `column` values per group across all shards."""
+    by = tuple(by)
+    return map_reduce(
+        paths,
+        functools.partial(partial_distinct, by=by, column=column),
+        functools.partial(merge_distinct, by=by, column=column),
+        workers,
+    )
+
+
+ID_COLUMNS = ("Provider_ID", "Receiver_ID", "Food_ID", "Claim_ID")
+
+
+def split_into_shards(csv_path, table, out_dir=FEEDS_DIR, n_shards=16, copies=1, id_offset=100_000):
+    """Split a CSV into per-city shard files, optionally repeating the rows for load tests.
+
+    Repeated copies get their IDs shifted by `id_offset` per copy so they stay
+    unique. The offset is fixed rather than derived from the file, so a claim's
+    Food_ID moves with its listing when both tables are split with the same
+    settings; IDs at or above it would collide and raise a ValueError.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    df = pd.read_csv(csv_path)
+    if copies > 1:
+        too_large = [c for c in ID_COLUMNS if c in df.columns and df[c].max() >= id_offset]
+        if too_large:
+            raise ValueError(f"{', '.join(too_large)} reach id_offset={id_offset}; copies would reuse IDs")
+        parts = []
+        for copy in range(copies):
+            part = df.copy()
+            for column in ID_COLUMNS:
+                if column in part.columns:
+                    part[column] += copy * id_offset
+            parts.append(part)
+        df = pd.concat(parts, ignore_index=True)
+    shard_of = pd.util.hash_array(df["City"].to_numpy()) % n_shards
+    for shard, part in df.groupby(shard_of):
+        part.to_csv(os.path.join(out_dir, f"{table}_{shard:03d}.csv"), index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest per-region shard files in parallel.")
+    parser.add_argument("--feeds", default=FEEDS_DIR)
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--split", action="store_true", help="first split the bundled CSVs into shards")
+    parser.add_argument("--shards", type=int, default=16)
+    parser.add_argument("--copies", type=int, default=1, help="repeat rows when splitting, for benchmarking")
+    args = parser.parse_args()
+
+    if args.split:
+        split_into_shards("providers_foodlisting.csv", "providers_foodlisting", args.feeds, args.shards, args.copies)
+        split_into_shards("receivers_claims.csv", "receivers_claims", args.feeds, args.shards, args.copies)
+    print(ingest_shards(args.feeds, args.db, args.workers))
+    shards = discover_shards(args.feeds)
+    print(sharded_distinct(shards["providers_foodlisting"], ["City"], "Provider_ID", args.workers).head())
+    print(sharded_count(shards["receivers_claims"], ["Status"], workers=args.workers))
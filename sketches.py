@@ -0,0 +1,568 @@
+# Approximate distinct counts and heavy hitters
+#
+# Exact COUNT(DISTINCT ...) has to scan every row each time it is asked. This
+# module keeps small, mergeable summaries instead:
+#   - HyperLogLog sketches of distinct Provider_IDs (per city) and distinct
+#     Receiver_IDs (per city and per claim day). Relative error is about
+#     1.04 / sqrt(2 ** precision), whatever the number of rows.
+#   - Count-min sketches of claims per Food_ID and per receiver Contact (per
+#     claim day), each with a short list of candidate heavy hitters. Estimates
+#     never undercount and overcount by at most epsilon * total claims with
+#     probability 1 - delta.
+#
+# Both kinds merge without loss (register max / counter sum), so sketches built
+# per day, per city or per shard combine into any window, city set or whole
+# feed. They are stored in the `sketches` table, one row per
+# (Metric, City, Day), with '*' rows for the all-cities and all-days rollups.
+# update_sketches only folds in rows added since the last run. An insert
+# trigger on each source table queues the new rowid in sketch_queue; a rowid
+# watermark would miss rows, since SQLite hands out the rowid of a deleted
+# last row again. Deleted or edited rows stay counted until the next rebuild.
+
+import json
+import math
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from triggers import install_triggers
+from validation import TIMESTAMP_FORMAT
+
+SKETCH_TABLE = "sketches"
+SKETCH_STATE_TABLE = "sketch_state"
+SKETCH_QUEUE_TABLE = "sketch_queue"
+ALL = "*"
+
+# Default error bounds
+DISTINCT_ERROR = 0.02
+COUNT_EPSILON = 0.001
+COUNT_DELTA = 0.01
+# Candidate heavy hitters kept with every count-min sketch
+HEAVY_HITTER_CAPACITY = 100
+# A HyperLogLog stays sparse while at most 1/SPARSE_FRACTION of its registers are set
+SPARSE_FRACTION = 16
+
+# Metric -> (source table, column, kind, per city, per day)
+METRICS = {
+    "distinct_providers": ("providers_foodlisting", "Provider_ID", "hll", True, False),
+    "distinct_receivers": ("receivers_claims", "Receiver_ID", "hll", True, True),
+    "food_claims": ("receivers_claims", "Food_ID", "cms", False, True),
+    "contact_claims": ("receivers_claims", "Contact", "cms", False, True),
+}
+SOURCE_TABLES = sorted({spec[0] for spec in METRICS.values()})
+
+
+def _hash(values):
+    """Stable 64-bit hashes; integer-valued IDs hash the same whether read as int or float."""
+    values = pd.Series(values).dropna().infer_objects()
+    if pd.api.types.is_numeric_dtype(values):
+        values = values.astype(np.int64)
+    else:
+        values = values.astype(str).astype(object)
+    return pd.util.hash_array(values.to_numpy(), categorize=True)
+
+
+def _key(value):
+    # Candidate keys are kept as JSON, so numpy scalars become plain Python values
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _max_rank(index, rank):
+    """Sorted unique `index` values with the largest `rank` seen for each."""
+    order = np.lexsort((rank, index))
+    index, rank = index[order], rank[order]
+    last = np.append(index[1:] != index[:-1], True)
+    return index[last], rank[last]
+
+
+class HyperLogLog:
+    """Distinct-count sketch with 2 ** precision one-byte registers.
+
+    A sketch of a few values only keeps its non-zero registers (sorted register
+    indexes and their ranks) and switches to the dense array once more than
+    1/SPARSE_FRACTION of them are set, so per-day and per-city sketches of
+    small buckets cost bytes instead of 2 ** precision each.
+    """
+
+    kind = "hll"
+
+    def __init__(self, precision=12, registers=None, sparse=None):
+        if not 4 <= precision <= 18:
+            raise ValueError("precision must be between 4 and 18")
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = registers
+        self.sparse = None
+        if registers is None:
+            self._set_sparse(*(sparse or (np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint8))))
+
+    def _set_sparse(self, index, rank):
+        if len(index) > self.m // SPARSE_FRACTION:
+            self.registers = np.zeros(self.m, dtype=np.uint8)
+            self.registers[index] = rank
+            self.sparse = None
+        else:
+            self.sparse = (index.astype(np.uint32), rank.astype(np.uint8))
+
+    def _dense(self):
+        if self.registers is not None:
+            return self.registers
+        registers = np.zeros(self.m, dtype=np.uint8)
+        registers[self.sparse[0]] = self.sparse[1]
+        return registers
+
+    @classmethod
+    def for_error(cls, relative_error=DISTINCT_ERROR):
+        """Smallest sketch whose standard error is at most `relative_error`."""
+        precision = math.ceil(math.log2((1.04 / relative_error) ** 2))
+        return cls(min(max(precision, 4), 18))
+
+    @property
+    def relative_error(self):
+        return 1.04 / math.sqrt(self.m)
+
+    @staticmethod
+    def _positions(hashes, precision):
+        """Register index and rank (position of the first 1 bit) of each hash."""
+        index = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+        rest = hashes & np.uint64((1 << (64 - precision)) - 1)
+        bits = 64 - precision
+        with np.errstate(divide="ignore"):
+            top = np.floor(np.log2(rest.astype(np.float64)))
+        rank = np.where(rest > 0, bits - top, bits + 1).astype(np.uint8)
+        return index, rank
+
+    def add(self, values):
+        index, rank = self._positions(_hash(values), self.precision)
+        if self.registers is not None:
+            np.maximum.at(self.registers, index, rank)
+        else:
+            self._set_sparse(*_max_rank(np.concatenate([self.sparse[0], index]), np.concatenate([self.sparse[1], rank])))
+        return self
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("cannot merge HyperLogLog sketches of different precision")
+        if self.sparse is not None and other.sparse is not None:
+            return HyperLogLog(self.precision, sparse=_max_rank(
+                np.concatenate([self.sparse[0], other.sparse[0]]), np.concatenate([self.sparse[1], other.sparse[1]])
+            ))
+        return HyperLogLog(self.precision, np.maximum(self._dense(), other._dense()))
+
+    def count(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        if self.sparse is not None:
+            # Every unset register adds 2 ** 0 to the harmonic sum
+            zeros = m - len(self.sparse[0])
+            harmonic = zeros + np.sum(np.ldexp(1.0, -self.sparse[1].astype(np.int64)))
+        else:
+            zeros = int(np.count_nonzero(self.registers == 0))
+            harmonic = np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        estimate = alpha * m * m / harmonic
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate while most registers are empty
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def params(self):
+        if self.sparse is not None:
+            return {"precision": self.precision, "sparse": True}
+        return {"precision": self.precision}
+
+    def to_bytes(self):
+        if self.sparse is not None:
+            return zlib.compress(self.sparse[0].tobytes() + self.sparse[1].tobytes())
+        return zlib.compress(self.registers.tobytes())
+
+    @classmethod
+    def from_bytes(cls, params, data):
+        data = zlib.decompress(data)
+        if params.get("sparse"):
+            # uint32 indexes followed by uint8 ranks
+            n = len(data) // 5
+            index = np.frombuffer(data[:4 * n], dtype=np.uint32).copy()
+            rank = np.frombuffer(data[4 * n:], dtype=np.uint8).copy()
+            return cls(params["precision"], sparse=(index, rank))
+        registers = np.frombuffer(data, dtype=np.uint8).copy()
+        return cls(params["precision"], registers)
+
+
+class CountMinSketch:
+    """Frequency sketch with `depth` rows of `width` counters and candidate heavy hitters."""
+
+    kind = "cms"
+
+    def __init__(self, width=2719, depth=5, table=None, candidates=None, capacity=HEAVY_HITTER_CAPACITY):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64) if table is None else table
+        self.candidates = list(candidates or [])
+        self.capacity = capacity
+
+    @classmethod
+    def for_error(cls, epsilon=COUNT_EPSILON, delta=COUNT_DELTA, capacity=HEAVY_HITTER_CAPACITY):
+        """Overcount at most epsilon * total with probability 1 - delta."""
+        return cls(math.ceil(math.e / epsilon), math.ceil(math.log(1 / delta)), capacity=capacity)
+
+    @property
+    def epsilon(self):
+        return math.e / self.width
+
+    @property
+    def delta(self):
+        return math.exp(-self.depth)
+
+    @property
+    def total(self):
+        return int(self.table[0].sum())
+
+    @property
+    def error_bound(self):
+        """Largest expected overcount of any estimate."""
+        return self.epsilon * self.total
+
+    @staticmethod
+    def _columns(hashes, width, depth):
+        # Row i uses h1 + i * h2 (double hashing), shape (len(hashes), depth)
+        h1 = (hashes & np.uint64(0xFFFFFFFF)).astype(np.int64)
+        h2 = (hashes >> np.uint64(32)).astype(np.int64) | 1
+        return (h1[:, None] + np.arange(depth)[None, :] * h2[:, None]) % width
+
+    def add(self, values):
+        values = pd.Series(values).dropna()
+        columns = self._columns(_hash(values), self.width, self.depth)
+        np.add.at(self.table, (np.arange(self.depth)[None, :], columns), 1)
+        self._keep_candidates(values.value_counts().index[:self.capacity])
+        return self
+
+    def estimate(self, values):
+        """Estimated count of each value (never below the true count)."""
+        values = pd.Series(values)
+        if values.empty:
+            return np.zeros(0, dtype=np.int64)
+        columns = self._columns(_hash(values), self.width, self.depth)
+        return self.table[np.arange(self.depth)[None, :], columns].min(axis=1)
+
+    def _keep_candidates(self, new_values=()):
+        keys = pd.unique(pd.Series(self.candidates + [_key(v) for v in new_values], dtype=object))
+        if len(keys) > self.capacity:
+            estimates = self.estimate(keys)
+            keys = keys[np.argsort(-estimates, kind="stable")[:self.capacity]]
+        self.candidates = [_key(k) for k in keys]
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("cannot merge count-min sketches of different shape")
+        merged = CountMinSketch(self.width, self.depth, self.table + other.table, self.candidates, self.capacity)
+        merged._keep_candidates(other.candidates)
+        return merged
+
+    def heavy_hitters(self, k=10):
+        """The `k` candidates with the highest estimated counts, as (value, estimate) pairs."""
+        if not self.candidates:
+            return []
+        estimates = self.estimate(self.candidates)
+        order = np.argsort(-estimates, kind="stable")[:k]
+        return [(self.candidates[i], int(estimates[i])) for i in order]
+
+    def params(self):
+        return {"width": self.width, "depth": self.depth, "capacity": self.capacity, "candidates": self.candidates}
+
+    def to_bytes(self):
+        return zlib.compress(self.table.tobytes())
+
+    @classmethod
+    def from_bytes(cls, params, data):
+        table = np.frombuffer(zlib.decompress(data), dtype=np.int64).reshape(params["depth"], params["width"]).copy()
+        return cls(params["width"], params["depth"], table, params["candidates"], params["capacity"])
+
+
+SKETCH_KINDS = {"hll": HyperLogLog, "cms": CountMinSketch}
+
+
+def new_sketch(kind, config):
+    if kind == "hll":
+        return HyperLogLog.for_error(config["distinct_error"])
+    return CountMinSketch.for_error(config["epsilon"], config["delta"])
+
+
+def sketch_config(distinct_error=DISTINCT_ERROR, epsilon=COUNT_EPSILON, delta=COUNT_DELTA):
+    return {"distinct_error": distinct_error, "epsilon": epsilon, "delta": delta}
+
+
+# --- Building sketches from rows ---
+
+def _claim_days(frame):
+    """Claim day of every row as YYYY-MM-DD ('' when unknown), ALL for undated tables."""
+    if "Timestamp_formatted" not in frame.columns:
+        return pd.Series(ALL, index=frame.index)
+    day = pd.to_datetime(frame["Timestamp_formatted"], format=TIMESTAMP_FORMAT, errors="coerce")
+    return day.dt.strftime("%Y-%m-%d").fillna("")
+
+
+def _buckets(city, day, per_city, per_day):
+    """Group codes and (City, Day) labels of every row, once per rollup level."""
+    city_codes, cities = pd.factorize(city)
+    day_codes, days = pd.factorize(day)
+    levels = [(False, False)]
+    if per_city:
+        levels.append((True, False))
+    if per_day:
+        levels.append((False, True))
+    if per_city and per_day:
+        levels.append((True, True))
+    for by_city, by_day in levels:
+        combined = (city_codes if by_city else 0) * len(days) + (day_codes if by_day else 0)
+        codes, uniques = pd.factorize(np.broadcast_to(combined, city_codes.shape))
+        labels = [
+            (cities[u // len(days)] if by_city else ALL, days[u % len(days)] if by_day else ALL)
+            for u in uniques
+        ]
+        yield codes, labels
+
+
+def _group_hll(hashes, codes, n_groups, precision):
+    # All groups at once: the largest rank per (group, register), sorted by
+    # group, so each group takes one slice and stays sparse when it is small
+    index, rank = HyperLogLog._positions(hashes, precision)
+    key, rank = _max_rank(codes.astype(np.int64) << precision | index, rank)
+    bounds = np.searchsorted(key >> precision, np.arange(n_groups + 1))
+    mask = (1 << precision) - 1
+    return [
+        HyperLogLog(precision, sparse=(key[lo:hi] & mask, rank[lo:hi]))
+        for lo, hi in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+def _group_cms(values, codes, n_groups, template):
+    # All groups at once: one counter table per group, candidates from exact per-group counts
+    columns = CountMinSketch._columns(_hash(values), template.width, template.depth)
+    tables = np.zeros((n_groups, template.depth, template.width), dtype=np.int64)
+    np.add.at(tables, (codes[:, None], np.arange(template.depth)[None, :], columns), 1)
+    counts = pd.DataFrame({"group": codes, "value": values.to_numpy()}).value_counts()
+    top = counts.groupby(level="group").head(template.capacity).reset_index()
+    candidates = top.groupby("group")["value"].agg(list)
+    return [
+        CountMinSketch(template.width, template.depth, tables[code],
+                       [_key(v) for v in candidates.get(code, [])], template.capacity)
+        for code in range(n_groups)
+    ]
+
+
+def build_sketches(frame, table, config=None):
+    """Sketches of every metric sourced from `table`, as {(Metric, City, Day): sketch}."""
+    config = config or sketch_config()
+    result = {}
+    if frame.empty:
+        return result
+    city = frame["City"].fillna("").astype(str)
+    day = _claim_days(frame)
+    for metric, (source, column, kind, per_city, per_day) in METRICS.items():
+        if source != table:
+            continue
+        keep = frame[column].notna().to_numpy()
+        rows = frame[keep]
+        for codes, labels in _buckets(city[keep], day[keep], per_city, per_day):
+            template = new_sketch(kind, config)
+            if kind == "hll":
+                sketches = _group_hll(_hash(rows[column]), codes, len(labels), template.precision)
+            else:
+                sketches = _group_cms(rows[column], codes, len(labels), template)
+            for (bucket_city, bucket_day), sketch in zip(labels, sketches):
+                result[(metric, bucket_city, bucket_day)] = sketch
+    return result
+
+
+def merge_sketch_sets(sketch_sets):
+    """Merge several {(Metric, City, Day): sketch} dicts, e.g. one per shard or per batch."""
+    merged = {}
+    for sketches in sketch_sets:
+        for key, sketch in sketches.items():
+            merged[key] = merged[key].merge(sketch) if key in merged else sketch
+    return merged
+
+
+def sketch_file(path, table, config=None):
+    """Sketches of one CSV shard; runs in a worker process for map_reduce."""
+    return build_sketches(pd.read_csv(path), table, config)
+
+
+# --- Storage ---
+
+def _create_tables(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SKETCH_TABLE} (
+            Metric TEXT NOT NULL,
+            City TEXT NOT NULL,
+            Day TEXT NOT NULL,
+            Kind TEXT NOT NULL,
+            Params TEXT NOT NULL,
+            Data BLOB NOT NULL,
+            PRIMARY KEY (Metric, City, Day)
+        )
+    """)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {SKETCH_STATE_TABLE} (Name TEXT PRIMARY KEY, Value TEXT)")
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {SKETCH_QUEUE_TABLE} (Seq INTEGER PRIMARY KEY, Source TEXT NOT NULL, Row_ID INTEGER NOT NULL)"
+    )
+
+
+def _create_triggers(conn):
+    return install_triggers(conn, {
+        f"trg_sketches_{table}_insert": f"AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {SKETCH_QUEUE_TABLE} (Source, Row_ID) VALUES ('{table}', NEW.rowid); END"
+        for table in SOURCE_TABLES
+    })
+
+
+def _state(conn, name, default=None):
+    row = conn.execute(f"SELECT Value FROM {SKETCH_STATE_TABLE} WHERE Name = ?", (name,)).fetchone()
+    return json.loads(row[0]) if row else default
+
+
+def _set_state(conn, name, value):
+    conn.execute(
+        f"INSERT INTO {SKETCH_STATE_TABLE} (Name, Value) VALUES (?, ?) "
+        f"ON CONFLICT (Name) DO UPDATE SET Value = excluded.Value",
+        (name, json.dumps(value)),
+    )
+
+
+def _decode(kind, params, data):
+    return SKETCH_KINDS[kind].from_bytes(json.loads(params), data)
+
+
+def save_sketches(conn, sketches, merge=True):
+    """Store sketches, merging into the stored ones unless `merge` is False."""
+    for (metric, city, day), sketch in sketches.items():
+        if merge:
+            stored = load_sketch(conn, metric, city, day)
+            if stored is not None:
+                sketch = stored.merge(sketch)
+        conn.execute(
+            f"INSERT OR REPLACE INTO {SKETCH_TABLE} (Metric, City, Day, Kind, Params, Data) VALUES (?, ?, ?, ?, ?, ?)",
+            (metric, city, day, sketch.kind, json.dumps(sketch.params()), sketch.to_bytes()),
+        )
+
+
+def _locked(conn, work):
+    # Under the write lock, so two sessions never fold in the same queued rows
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = work()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return result
+
+
+def update_sketches(conn, config=None):
+    """Fold rows queued since the last update into the stored sketches. Returns rows read."""
+    if conn.execute(f"SELECT 1 FROM {SKETCH_QUEUE_TABLE} LIMIT 1").fetchone() is None:
+        return 0
+
+    def work():
+        read = 0
+        for table in SOURCE_TABLES:
+            # IN also collapses a rowid queued twice (deleted, then handed out again)
+            new_rows = pd.read_sql_query(
+                f"SELECT * FROM {table} WHERE rowid IN (SELECT Row_ID FROM {SKETCH_QUEUE_TABLE} WHERE Source = ?)",
+                conn, params=(table,),
+            )
+            if not new_rows.empty:
+                save_sketches(conn, build_sketches(new_rows, table, config or _state(conn, "config", sketch_config())))
+                read += len(new_rows)
+        conn.execute(f"DELETE FROM {SKETCH_QUEUE_TABLE}")
+        return read
+
+    return _locked(conn, work)
+
+
+def rebuild_sketches(conn, config=None):
+    """Replace every stored sketch with one built from the full source tables. Returns rows read."""
+    config = config or sketch_config()
+
+    def work():
+        conn.execute(f"DELETE FROM {SKETCH_TABLE}")
+        conn.execute(f"DELETE FROM {SKETCH_STATE_TABLE}")
+        conn.execute(f"DELETE FROM {SKETCH_QUEUE_TABLE}")
+        _set_state(conn, "config", config)
+        read = 0
+        for table in SOURCE_TABLES:
+            rows = pd.read_sql_query(f"SELECT * FROM {table}", conn)
+            save_sketches(conn, build_sketches(rows, table, config), merge=False)
+            read += len(rows)
+        return read
+
+    return _locked(conn, work)
+
+
+def init_sketches(conn, rebuild=False, config=None):
+    """Create the sketch tables and bring them up to date.
+
+    Sketches are rebuilt from scratch when asked to (e.g. after the base tables
+    were replaced), when the insert triggers were missing (rows may have been
+    added unseen) or when the configured error bounds changed.
+    """
+    config = config or sketch_config()
+    _create_tables(conn)
+    installed = _create_triggers(conn)
+    if rebuild or installed or _state(conn, "config") != config:
+        return rebuild_sketches(conn, config)
+    return update_sketches(conn, config)
+
+
+def load_sketch(conn, metric, city=ALL, day=ALL):
+    row = conn.execute(
+        f"SELECT Kind, Params, Data FROM {SKETCH_TABLE} WHERE Metric = ? AND City = ? AND Day = ?",
+        (metric, city, day),
+    ).fetchone()
+    return _decode(*row) if row else None
+
+
+def window_sketch(conn, metric, city=ALL, start=None, end=None):
+    """One sketch for a metric over a city and an inclusive day range (all days if both are None)."""
+    if start is None and end is None:
+        return load_sketch(conn, metric, city)
+    rows = conn.execute(
+        f"SELECT Kind, Params, Data FROM {SKETCH_TABLE} "
+        f"WHERE Metric = ? AND City = ? AND Day != ? AND Day >= ? AND Day <= ?",
+        (metric, city, ALL, str(start or ""), str(end or "9999-12-31")),
+    ).fetchall()
+    merged = None
+    for row in rows:
+        sketch = _decode(*row)
+        merged = sketch if merged is None else merged.merge(sketch)
+    return merged
+
+
+def approx_distinct(conn, metric, city=ALL, start=None, end=None):
+    """(estimated distinct count, relative standard error), or (0, 0.0) with no data."""
+    sketch = window_sketch(conn, metric, city, start, end)
+    if sketch is None:
+        return 0, 0.0
+    return sketch.count(), sketch.relative_error
+
+
+def approx_distinct_by_city(conn, metric):
+    """Estimated distinct count per city as a DataFrame with City and the metric as columns."""
+    rows = conn.execute(
+        f"SELECT City, Kind, Params, Data FROM {SKETCH_TABLE} WHERE Metric = ? AND City != ? AND Day = ?",
+        (metric, ALL, ALL),
+    ).fetchall()
+    return pd.DataFrame(
+        [(city, _decode(kind, params, data).count()) for city, kind, params, data in rows],
+        columns=["City", metric],
+    )
+
+
+def heavy_hitters(conn, metric, k=10, start=None, end=None):
+    """Top-k values by estimated count and the sketch's overcount bound."""
+    sketch = window_sketch(conn, metric, ALL, start, end)
+    if sketch is None:
+        return pd.DataFrame(columns=["Value", "Estimated_Count"]), 0.0
+    return pd.DataFrame(sketch.heavy_hitters(k), columns=["Value", "Estimated_Count"]), sketch.error_bound
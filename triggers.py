@@ -0,0 +1,37 @@
+# Trigger installation shared by the rollup and history tables
+#
+# Every dashboard rerun makes sure its triggers are installed. Dropping and
+# recreating them each time races between sessions: one session drops a
+# trigger while another creates it ("trigger ... already exists"), and writes
+# in between run without it. install_triggers compares the wanted definitions
+# with sqlite_master and only touches the ones that are missing or changed
+# (after a table reload or a code change), inside one IMMEDIATE transaction
+# that re-checks under the write lock.
+
+
+def _stale(conn, wanted):
+    installed = dict(conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'").fetchall())
+    return [name for name, sql in wanted.items() if installed.get(name) != sql]
+
+
+def install_triggers(conn, triggers):
+    """Install `triggers` ({name: definition after the name}) where missing or different.
+
+    Commits any open transaction of `conn` first. Returns the names that were (re)created.
+    """
+    wanted = {name: f"CREATE TRIGGER {name} {body}" for name, body in triggers.items()}
+    if not _stale(conn, wanted):
+        return []
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Another session may have installed them while this one waited for the lock
+        stale = _stale(conn, wanted)
+        for name in stale:
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+            conn.execute(wanted[name])
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return stale
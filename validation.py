@@ -0,0 +1,214 @@
+# Validation and quarantine for incoming listings and claims
+#
+# Rows are checked a chunk at a time with vectorized pandas/numpy rules, each
+# rule producing one boolean "failed" mask over the chunk. Rows that fail any
+# rule are split off with a Reasons column naming every failed rule and go to
+# the quarantine table; the rest are returned with their columns coerced to
+# the right types.
+#
+# Rules that span chunks (unique Food_ID / Claim_ID, claims pointing at a known
+# listing) keep the accepted IDs in sorted numpy arrays on the Validator, so
+# they are also checked with a vectorized np.searchsorted instead of per-row
+# lookups. The per-row rules need no state: check_listing_rows and
+# check_claim_rows run them on their own (e.g. in worker processes), and the
+# Validator's check_*_ids then only applies the ID rules to the rows that passed.
+
+import json
+
+import numpy as np
+import pandas as pd
+
+QUARANTINE_TABLE = "quarantine"
+QUARANTINE_COLUMNS = ["Source_Table", "Row_Number", "Reasons", "Record"]
+
+CLAIM_STATUSES = ("Pending", "Completed", "Cancelled")
+EXPIRY_FORMAT = "%Y-%m-%d"
+TIMESTAMP_FORMAT = "%H:%M:%S %d-%m-%Y"
+
+CHUNKSIZE = 100_000
+
+
+def _to_int(series):
+    """Coerce to nullable integers; anything non-numeric or fractional becomes NA."""
+    numbers = pd.to_numeric(series, errors="coerce")
+    whole = numbers.notna() & (numbers % 1 == 0)
+    return numbers.where(whole).astype("Int64")
+
+
+def _blank(series):
+    return series.fillna("").astype(str).str.strip().eq("")
+
+
+def _seen(sorted_ids, ids):
+    """Mask of `ids` (float array, NaN for missing) already present in `sorted_ids`."""
+    if len(sorted_ids) == 0:
+        return np.zeros(len(ids), dtype=bool)
+    pos = np.searchsorted(sorted_ids, ids).clip(max=len(sorted_ids) - 1)
+    return sorted_ids[pos] == ids
+
+
+def _remember(sorted_ids, new_ids):
+    # Both inputs are sorted runs, which the stable sort merges in linear time
+    return np.sort(np.concatenate([sorted_ids, np.sort(new_ids)]), kind="stable")
+
+
+def _split(chunk, failures):
+    """Split a chunk into (clean rows, quarantined rows with a Reasons column)."""
+    failed = pd.DataFrame(failures, index=chunk.index)
+    bad_mask = failed.any(axis=1).to_numpy()
+    bad = chunk[bad_mask].copy()
+    # Reasons are only spelled out for the (few) rejected rows
+    failed = failed[bad_mask]
+    reasons = pd.Series("", index=bad.index)
+    for rule in failed.columns:
+        reasons = reasons.where(~failed[rule], reasons + rule + ";")
+    bad["Reasons"] = reasons.str.rstrip(";")
+    return chunk[~bad_mask], bad
+
+
+def listing_row_failures(chunk, as_of=None):
+    """Coerce a listing chunk and evaluate the rules that only look at each row.
+
+    Listings expiring before `as_of` fail; None skips the check. Returns
+    (coerced chunk, {rule: failed mask}).
+    """
+    chunk = chunk.copy()
+    chunk.columns = chunk.columns.str.strip()
+    for column in ("Provider_ID", "Food_ID", "Quantity"):
+        chunk[column] = _to_int(chunk[column])
+    expiry = pd.to_datetime(chunk["Expiry_Date"], format=EXPIRY_FORMAT, errors="coerce")
+
+    failures = {
+        "missing_provider_id": chunk["Provider_ID"].isna(),
+        "missing_food_id": chunk["Food_ID"].isna(),
+        "invalid_quantity": chunk["Quantity"].isna() | (chunk["Quantity"] <= 0),
+        "missing_name": _blank(chunk["Name"]),
+        "missing_city": _blank(chunk["City"]),
+        "invalid_expiry_date": expiry.isna(),
+        "provider_type_mismatch": chunk["Provider_Type"].ne(chunk["Type"]),
+        "location_mismatch": chunk["Location"].ne(chunk["City"]),
+    }
+    if as_of is not None:
+        failures["expired"] = expiry.notna() & (expiry < pd.Timestamp(as_of))
+    return chunk, failures
+
+
+def claim_row_failures(chunk):
+    """Coerce a claim chunk and evaluate the rules that only look at each row."""
+    chunk = chunk.copy()
+    chunk.columns = chunk.columns.str.strip()
+    for column in ("Receiver_ID", "Claim_ID", "Food_ID"):
+        chunk[column] = _to_int(chunk[column])
+    timestamp = pd.to_datetime(chunk["Timestamp_formatted"], format=TIMESTAMP_FORMAT, errors="coerce")
+
+    failures = {
+        "missing_receiver_id": chunk["Receiver_ID"].isna(),
+        "missing_claim_id": chunk["Claim_ID"].isna(),
+        "invalid_status": ~chunk["Status"].isin(CLAIM_STATUSES),
+        "invalid_timestamp": timestamp.isna(),
+    }
+    return chunk, failures
+
+
+def check_listing_rows(chunk, as_of=None):
+    """Split a listing chunk on the per-row rules only: (coerced clean rows, rejected rows)."""
+    return _split(*listing_row_failures(chunk, as_of))
+
+
+def check_claim_rows(chunk):
+    """Split a claim chunk on the per-row rules only: (coerced clean rows, rejected rows)."""
+    return _split(*claim_row_failures(chunk))
+
+
+class Validator:
+    """Validates listing chunks, then claim chunks, remembering accepted IDs."""
+
+    def __init__(self, as_of=None):
+        # Listings expiring before this date are rejected; None skips the check
+        self.as_of = pd.Timestamp(as_of) if as_of is not None else None
+        self.food_ids = np.empty(0, dtype=np.float64)
+        self.claim_ids = np.empty(0, dtype=np.float64)
+
+    def _listing_id_failures(self, chunk):
+        food_ids = chunk["Food_ID"].to_numpy(dtype=np.float64, na_value=np.nan)
+        return {
+            "duplicate_food_id": chunk["Food_ID"].duplicated(keep="first") & chunk["Food_ID"].notna()
+            | pd.Series(_seen(self.food_ids, food_ids), index=chunk.index),
+        }
+
+    def _claim_id_failures(self, chunk):
+        claim_ids = chunk["Claim_ID"].to_numpy(dtype=np.float64, na_value=np.nan)
+        food_ids = chunk["Food_ID"].to_numpy(dtype=np.float64, na_value=np.nan)
+        return {
+            "duplicate_claim_id": chunk["Claim_ID"].duplicated(keep="first") & chunk["Claim_ID"].notna()
+            | pd.Series(_seen(self.claim_ids, claim_ids), index=chunk.index),
+            "unknown_food_id": pd.Series(~_seen(self.food_ids, food_ids), index=chunk.index),
+        }
+
+    def _accept_listings(self, clean, bad):
+        self.food_ids = _remember(self.food_ids, clean["Food_ID"].to_numpy(dtype=np.float64))
+        return clean, bad
+
+    def _accept_claims(self, clean, bad):
+        self.claim_ids = _remember(self.claim_ids, clean["Claim_ID"].to_numpy(dtype=np.float64))
+        return clean, bad
+
+    def validate_listings(self, chunk):
+        chunk, failures = listing_row_failures(chunk, self.as_of)
+        failures.update(self._listing_id_failures(chunk))
+        return self._accept_listings(*_split(chunk, failures))
+
+    def validate_claims(self, chunk):
+        chunk, failures = claim_row_failures(chunk)
+        failures.update(self._claim_id_failures(chunk))
+        return self._accept_claims(*_split(chunk, failures))
+
+    def check_listing_ids(self, clean):
+        """ID rules only, for listing rows that already passed check_listing_rows."""
+        return self._accept_listings(*_split(clean, self._listing_id_failures(clean)))
+
+    def check_claim_ids(self, clean):
+        """ID rules only, for claim rows that already passed check_claim_rows."""
+        return self._accept_claims(*_split(clean, self._claim_id_failures(clean)))
+
+
+def read_validated(listings_path, claims_path, as_of=None, chunksize=CHUNKSIZE):
+    """Read both CSVs chunk by chunk through a Validator.
+
+    Returns (listings, claims, quarantined) where quarantined holds the rejected
+    rows of both files, ready for write_quarantine.
+    """
+    validator = Validator(as_of)
+    listings, claims, quarantined = [], [], []
+    for source, path, check, accepted in (
+        ("providers_foodlisting", listings_path, validator.validate_listings, listings),
+        ("receivers_claims", claims_path, validator.validate_claims, claims),
+    ):
+        for chunk in pd.read_csv(path, chunksize=chunksize):
+            clean, bad = check(chunk)
+            accepted.append(clean)
+            quarantined.append(quarantine_records(source, bad))
+    return (
+        pd.concat(listings, ignore_index=True),
+        pd.concat(claims, ignore_index=True),
+        pd.concat(quarantined, ignore_index=True),
+    )
+
+
+def quarantine_records(source, bad):
+    """Shape rejected rows for the quarantine table: one JSON record per row."""
+    raw = bad.drop(columns="Reasons")
+    raw = raw.astype(object).where(raw.notna(), None)
+    return pd.DataFrame({
+        "Source_Table": source,
+        # Row number in the source file, counting from 1 after the header
+        "Row_Number": bad.index.to_numpy() + 1,
+        "Reasons": bad["Reasons"].to_numpy(),
+        "Record": [json.dumps(record, default=str) for record in raw.to_dict("records")],
+    }, columns=QUARANTINE_COLUMNS)
+
+
+def write_quarantine(conn, quarantined, replace=True):
+    """Store rejected rows with their reasons."""
+    quarantined.to_sql(QUARANTINE_TABLE, conn, if_exists="replace" if replace else "append", index=False)
+    conn.commit()